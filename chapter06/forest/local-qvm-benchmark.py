@@ -0,0 +1,69 @@
+"""Benchmark of the local QVM against the PyQVM which comes with pyQuil.
+
+The PyQVM is driven with load() and run().wait(), which only pyQuil 2 has,
+so this script needs pyQuil 2. The local QVM itself also runs on later
+versions.
+"""
+
+# Imports
+import time
+
+import numpy as np
+
+from pyquil import Program
+from pyquil.gates import H, MEASURE
+from pyquil.paulis import sI, sX, sZ, exponentiate_commuting_pauli_sum
+from pyquil.pyqvm import PyQVM
+
+import local_qvm
+
+
+def qaoa_program(nqubits=4, trials=1000):
+    """Returns the P = 2 QAOA program for a line graph from Chapter 9."""
+    graph = [(i, i + 1) for i in range(nqubits - 1)]
+    h_cost = -0.5 * sum(sI(0) - sZ(i) * sZ(j) for i, j in graph)
+    h_driver = -1. * sum(sX(i) for i in range(nqubits))
+
+    program = Program([H(i) for i in range(nqubits)])
+    for gamma, beta in zip([0., 0.5], [0.75, 1.]):
+        program += exponentiate_commuting_pauli_sum(h_cost)(gamma)
+        program += exponentiate_commuting_pauli_sum(h_driver)(beta)
+    ro = program.declare("ro", "BIT", nqubits)
+    program += [MEASURE(i, ro[i]) for i in range(nqubits)]
+    program.wrap_in_numshots_loop(trials)
+    return program
+
+
+def benchmark_qaoa(nqubits=4, trials=1000):
+    """Compares running the trials of the QAOA program one by one on a PyQVM
+    with running them together on the local QVM."""
+    program = qaoa_program(nqubits, trials)
+
+    if not hasattr(PyQVM, "load"):
+        raise RuntimeError("This benchmark needs the PyQVM of pyQuil 2.")
+
+    start = time.perf_counter()
+    pyqvm = PyQVM(n_qubits=nqubits)
+    pyqvm.load(program)
+    expected = pyqvm.run().wait().read_memory(region_name="ro")
+    pyqvm_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bits = local_qvm.get_qc("{}q-qvm".format(nqubits)).run(program)
+    local_time = time.perf_counter() - start
+
+    print("P = 2 QAOA on {} qubits, {} trials".format(nqubits, trials))
+    print("PyQVM:     {:.3f} s".format(pyqvm_time))
+    print("Local QVM: {:.3f} s ({:.0f}x faster)".format(
+        local_time, pyqvm_time / local_time))
+
+    # Compare the frequencies of the bitstrings
+    powers = 2 ** np.arange(nqubits)
+    expected_hist = np.bincount(expected @ powers, minlength=2 ** nqubits)
+    hist = np.bincount(bits @ powers, minlength=2 ** nqubits)
+    print("Total variation distance: {:.3f}".format(
+        np.sum(np.abs(hist - expected_hist)) / (2 * trials)))
+
+
+if __name__ == "__main__":
+    benchmark_qaoa()
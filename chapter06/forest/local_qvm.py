@@ -0,0 +1,240 @@
+"""An in-process QVM for the pyQuil examples.
+
+pyquil.get_qc() needs a QVM server running next to the script. The
+LocalQVM returned by get_qc() in this module simulates the programs of the
+examples with numpy instead. It has the run(), run_and_measure() and
+compile() methods that the examples use, so it can be swapped in for the
+QuantumComputer of pyquil.get_qc().
+
+The state is simulated once for all trials. When every MEASURE comes after
+the last gate, as in the examples, all trials are sampled at once from the
+final probabilities. Otherwise each trial gets its own copy of the state
+from the first MEASURE on, and the copies are collapsed together.
+"""
+
+# Imports
+import re
+
+import numpy as np
+
+from pyquil import Program
+from pyquil.quilatom import BinaryExp, Function, MemoryReference
+from pyquil.quilbase import Declare, Gate, Halt, Measurement, Pragma, Reset
+
+try:
+    from pyquil.simulation.matrices import QUANTUM_GATES
+except ImportError:
+    from pyquil.gate_matrices import QUANTUM_GATES
+
+
+# Numpy types of the classical memory regions
+MEMORY_TYPES = {"BIT": np.int8, "OCTET": np.uint8, "INTEGER": np.int64,
+                "REAL": np.float64}
+
+
+def _evaluate(param, memory):
+    """Returns the value of a gate parameter, which may be an expression in
+    classical memory."""
+    if isinstance(param, MemoryReference):
+        return memory[param.name][param.offset]
+    if isinstance(param, BinaryExp):
+        return param.fn(_evaluate(param.op1, memory),
+                        _evaluate(param.op2, memory))
+    if isinstance(param, Function):
+        return param.fn(_evaluate(param.expression, memory))
+    return param
+
+
+def _modified(matrix, modifiers):
+    """Applies the DAGGER and CONTROLLED modifiers of a gate to its matrix."""
+    for modifier in reversed(modifiers):
+        if modifier == "DAGGER":
+            matrix = matrix.conj().T
+        elif modifier == "CONTROLLED":
+            size = matrix.shape[0]
+            controlled = np.eye(2 * size, dtype=complex)
+            controlled[size:, size:] = matrix
+            matrix = controlled
+        else:
+            raise ValueError("The {} modifier is not supported.".format(
+                modifier))
+    return matrix
+
+
+class LocalExecutable:
+    """A program prepared for a LocalQVM.
+
+    The gates are stored with the axes of their qubits in the state, and
+    the matrices of gates without memory parameters are computed here once.
+    Gates with memory parameters are computed on every run from the values
+    in memory, so one executable serves every parameter value.
+    """
+
+    def __init__(self, program, num_qubits):
+        self.num_shots = program.num_shots
+        self.declarations = {}
+        self.steps = []
+        self.measurements = []
+
+        qubits = sorted(q.index for q in program.get_qubits(indices=False))
+        if qubits and qubits[-1] >= num_qubits:
+            raise ValueError("The program uses qubit {} of a {} qubit "
+                             "QVM.".format(qubits[-1], num_qubits))
+        axis = {q: k for k, q in enumerate(qubits)}
+        self.num_qubits = len(qubits)
+
+        for instruction in program.instructions:
+            if isinstance(instruction, Declare):
+                self.declarations[instruction.name] = (
+                    instruction.memory_type, instruction.memory_size)
+            elif isinstance(instruction, Gate):
+                if self.measurements:
+                    self.measurements.append(None)
+                axes = [axis[q.index] for q in instruction.qubits]
+                if any(isinstance(p, (MemoryReference, BinaryExp, Function))
+                       for p in instruction.params):
+                    self.steps.append((instruction, axes))
+                else:
+                    self.steps.append((self._matrix(instruction, {}), axes))
+            elif isinstance(instruction, Measurement):
+                self.measurements.append(
+                    (axis[instruction.qubit.index], len(self.steps),
+                     instruction.classical_reg))
+            elif isinstance(instruction, Reset) and not self.steps:
+                # Every trial starts from |0...0> anyway.
+                pass
+            elif not isinstance(instruction, (Halt, Pragma)):
+                raise ValueError("{} is not supported.".format(instruction))
+
+        # A None marks a gate after a measurement.
+        self.final_measurements = None not in self.measurements
+        self.measurements = [m for m in self.measurements if m is not None]
+
+    @staticmethod
+    def _matrix(gate, memory):
+        params = [_evaluate(p, memory) for p in gate.params]
+        matrix = QUANTUM_GATES[gate.name]
+        if params:
+            matrix = matrix(*params)
+        return _modified(np.asarray(matrix, dtype=complex), gate.modifiers)
+
+
+class LocalQVM:
+    """A state-vector simulator with the interface of a pyQuil QVM."""
+
+    def __init__(self, num_qubits, seed=None):
+        self.num_qubits = num_qubits
+        self.rng = np.random.default_rng(seed)
+
+    def qubits(self):
+        """Returns the indices of the qubits."""
+        return list(range(self.num_qubits))
+
+    def compile(self, program):
+        """Returns a LocalExecutable for the program."""
+        return LocalExecutable(program, self.num_qubits)
+
+    def _apply(self, state, matrix, axes):
+        # Axis 0 of the state indexes trials and axis k + 1 qubit k.
+        nqubits = len(axes)
+        gate = matrix.reshape((2,) * 2 * nqubits)
+        targets = [a + 1 for a in axes]
+        state = np.tensordot(gate, state,
+                             axes=(list(range(nqubits, 2 * nqubits)), targets))
+        return np.moveaxis(state, list(range(nqubits)), targets)
+
+    def run(self, executable, memory_map=None):
+        """Runs an executable, or a Program which is compiled first.
+
+        Args:
+            executable: The LocalExecutable or Program to run.
+            memory_map: Values of declared memory regions, as in
+                QuantumComputer.run().
+
+        Returns:
+            The ro region of every trial, of shape (trials, size of ro).
+        """
+        if isinstance(executable, Program):
+            executable = self.compile(executable)
+        trials = executable.num_shots
+        memory = {name: np.zeros(size, dtype=MEMORY_TYPES[kind])
+                  for name, (kind, size) in executable.declarations.items()}
+        for name, values in (memory_map or {}).items():
+            memory[name][:len(values)] = values
+        ro = np.zeros((trials, memory["ro"].size if "ro" in memory else 0),
+                      dtype=MEMORY_TYPES["BIT"])
+
+        nqubits = executable.num_qubits
+        state = np.zeros((1,) + (2,) * nqubits, dtype=complex)
+        state[(0,) * (nqubits + 1)] = 1
+        measurements = iter(executable.measurements)
+        measurement = next(measurements, None)
+        for k, (gate, axes) in enumerate(executable.steps + [(None, None)]):
+            # Measurements made before step k
+            while measurement is not None and measurement[1] == k:
+                axis, _, reg = measurement
+                if executable.final_measurements:
+                    break
+                if state.shape[0] == 1:
+                    state = np.repeat(state, trials, axis=0)
+                branch = np.moveaxis(state, axis + 1, 1)
+                prob1 = np.sum(np.abs(branch[:, 1]) ** 2,
+                               axis=tuple(range(1, nqubits)))
+                bits = self.rng.random(trials) < prob1
+                branch[bits, 0] = 0
+                branch[~bits, 1] = 0
+                norms = np.sqrt(np.where(bits, prob1, 1 - prob1))
+                state /= norms.reshape((-1,) + (1,) * nqubits)
+                if reg is not None and reg.name == "ro":
+                    ro[:, reg.offset] = bits
+                measurement = next(measurements, None)
+            if gate is None:
+                break
+            if isinstance(gate, Gate):
+                gate = LocalExecutable._matrix(gate, memory)
+            state = self._apply(state, gate, axes)
+
+        if executable.final_measurements and executable.measurements:
+            # Sample every trial at once from the final state.
+            probs = np.abs(state.ravel()) ** 2
+            outcomes = self.rng.choice(probs.size, size=trials,
+                                       p=probs / probs.sum())
+            for axis, _, reg in executable.measurements:
+                if reg is None or reg.name != "ro":
+                    continue
+                ro[:, reg.offset] = (outcomes >> (nqubits - 1 - axis)) & 1
+        return ro
+
+    def run_and_measure(self, program, trials):
+        """Runs a program and measures every qubit it uses.
+
+        Returns:
+            A dictionary from each qubit of the QVM to its bits in every
+            trial, as QuantumComputer.run_and_measure() returns. Qubits
+            which the program does not use are always 0.
+        """
+        program = program.copy()
+        qubits = sorted(program.get_qubits())
+        ro = program.declare("ro", "BIT", len(qubits))
+        for i, q in enumerate(qubits):
+            program.measure(q, ro[i])
+        program.wrap_in_numshots_loop(trials)
+        bits = self.run(program)
+        results = {q: np.zeros(trials, dtype=bits.dtype)
+                   for q in self.qubits()}
+        for i, q in enumerate(qubits):
+            results[q] = bits[:, i]
+        return results
+
+
+def get_qc(name, seed=None):
+    """Returns a LocalQVM in place of pyquil.get_qc(name).
+
+    The number of qubits is read from names such as "1q-qvm" or
+    "9q-generic-qvm".
+    """
+    match = re.match(r"(\d+)q-", name)
+    if match is None:
+        raise ValueError("Cannot read the number of qubits from {!r}.".format(
+            name))
+    return LocalQVM(int(match.group(1)), seed)
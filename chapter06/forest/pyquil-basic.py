@@ -1,5 +1,8 @@
 """Simple program in pyQuil."""
 
+# Imports
+import os
+
 # Import the pyQuil library
 import pyquil
 
@@ -19,8 +22,14 @@ prog += [
 print("Program:")
 print(prog)
 
-# Get a quantum computer to run on
-computer = pyquil.get_qc("1q-qvm")
+# Get a quantum computer to run on. With LOCAL_QVM=1 set in the environment
+# the program is simulated in this process instead of on a QVM server.
+if os.environ.get("LOCAL_QVM"):
+    import local_qvm
+    get_qc = local_qvm.get_qc
+else:
+    get_qc = pyquil.get_qc
+computer = get_qc("1q-qvm")
 
 # Simulate the program many times
 prog.wrap_in_numshots_loop(10)
@@ -0,0 +1,169 @@
+"""Benchmarks for the HHL example in hhl.py."""
+
+# Imports
+import math
+import time
+
+import numpy as np
+import cirq
+
+from hhl import (EigenRotation, hhl_circuit, hhl_transfer_matrix,
+                 solution_density_matrix, solve_batch)
+
+
+def decomposed_circuit(op):
+    """Returns a circuit of CZ and single-qubit gates implementing op, plus
+    its measurements.
+
+    Operations are decomposed as far as they go into CZ and single-qubit
+    gates. The two-qubit operations which do not decompose, such as the
+    controlled e^iAt of the 2x2 case, are then converted from their unitary
+    with the KAK decomposition, so that every circuit is counted in the same
+    gate set.
+    """
+    def keep(op):
+        return (cirq.num_qubits(op) <= 1 or cirq.is_measurement(op)
+                or isinstance(op.gate, cirq.CZPowGate))
+
+    def to_cz(op):
+        if keep(op):
+            return [op]
+        if cirq.num_qubits(op) == 2 and cirq.has_unitary(op):
+            return cirq.two_qubit_matrix_to_operations(
+                op.qubits[0], op.qubits[1], cirq.unitary(op),
+                allow_partial_czs=False)
+        raise ValueError("Cannot decompose {!r} into CZ and single-qubit "
+                         "gates.".format(op))
+
+    return cirq.Circuit(
+        converted
+        for op in cirq.decompose(op, keep=keep, on_stuck_raise=None)
+        for converted in to_cz(op))
+
+
+def gate_count(circuit):
+    """Returns the number of gates in a circuit, without measurements."""
+    return sum(1 for op in circuit.all_operations()
+               if not cirq.is_measurement(op))
+
+
+def random_problem(memory_size, register_size, t, rng):
+    """Returns a random Hermitian A whose eigenvalues can be represented
+    exactly by the register, and a random unit vector b."""
+    N = 2**register_size
+    ks = rng.choice(np.arange(1, N), size=2**memory_size, replace=False)
+    eigenvalues = 2*math.pi * ks / (N * t)
+    shape = (2**memory_size, 2**memory_size)
+    V, _ = np.linalg.qr(rng.normal(size=shape) + 1j*rng.normal(size=shape))
+    A = (V * eigenvalues) @ V.conj().T
+    b = rng.normal(size=shape[0]) + 1j*rng.normal(size=shape[0])
+    return A, b / np.linalg.norm(b)
+
+
+def state_prep_gate(b):
+    """Returns a gate preparing |b> from |0...0>."""
+    M = np.random.default_rng(0).normal(size=(len(b), len(b))) + 0j
+    M[:, 0] = b
+    Q, R = np.linalg.qr(M)
+    Q[:, 0] *= R[0, 0]
+    return cirq.MatrixGate(Q)
+
+
+def benchmark_eigen_rotation(register_sizes=range(2, 11),
+                             max_controlled_size=5):
+    """Compares the gate count and depth of the two EigenRotation
+    decompositions. The multi-controlled version is only built up to
+    max_controlled_size register qubits, as it grows too large beyond that."""
+    print("EigenRotation (CZ and single-qubit gates)")
+    print("{:>4} {:>24} {:>24}".format(
+        "n", "multi-controlled", "multiplexed"))
+    print("{:>4} {:>8} {:>7} {:>7} {:>8} {:>7} {:>7}".format(
+        "", "gates", "depth", "secs", "gates", "depth", "secs"))
+    for n in register_sizes:
+        qubits = cirq.LineQubit.range(n + 1)
+        # Keep every rotation angle valid for the register size.
+        C, t = 1.0, 2**(1 - n)
+        row = []
+        for multiplexed in (False, True):
+            if not multiplexed and n > max_controlled_size:
+                row.append("{:>8} {:>7} {:>7}".format("-", "-", "-"))
+                continue
+            start = time.perf_counter()
+            circuit = decomposed_circuit(
+                EigenRotation(n + 1, C, t, multiplexed)(*qubits))
+            elapsed = time.perf_counter() - start
+            row.append("{:>8} {:>7} {:>7.2f}".format(
+                gate_count(circuit), len(circuit), elapsed))
+        print("{:>4} {} {}".format(n, *row))
+
+
+def benchmark_memory_size(memory_sizes=(1, 2, 3), register_size=4, t=1.0,
+                          trotter_steps=2, seed=0):
+    """Solves random 2^m x 2^m systems with Trotterized HHL and reports the
+    circuit depth, the simulation time and the fidelity of the post-selected
+    solution with the normalized output of np.linalg.solve."""
+    rng = np.random.default_rng(seed)
+    C = 2*math.pi / (2**register_size * t)
+    print("HHL with m memory qubits ({} register qubits, {} Trotter steps)"
+          .format(register_size, trotter_steps))
+    print("{:>4} {:>8} {:>8} {:>8} {:>10}".format(
+        "m", "gates", "depth", "secs", "fidelity"))
+    for m in memory_sizes:
+        A, b = random_problem(m, register_size, t, rng)
+        circuit = hhl_circuit(A, C, t, register_size, state_prep_gate(b),
+                              trotter_steps=trotter_steps)
+        # The gates are counted without the preparation of |b>, which is an
+        # m-qubit matrix gate.
+        decomposed = decomposed_circuit(hhl_circuit(
+            A, C, t, register_size, trotter_steps=trotter_steps))
+
+        start = time.perf_counter()
+        rho = solution_density_matrix(circuit)
+        elapsed = time.perf_counter() - start
+
+        x = np.linalg.solve(A, b)
+        x /= np.linalg.norm(x)
+        fidelity = np.real(x.conj() @ rho @ x)
+        print("{:>4} {:>8} {:>8} {:>8.2f} {:>10.6f}".format(
+            m, gate_count(decomposed), len(decomposed),
+            elapsed, fidelity))
+
+
+def benchmark_batch_solve(num_rhs=16, memory_size=2, register_size=4, t=1.0,
+                          trotter_steps=2, seed=0):
+    """Compares solving for many |b> with one circuit per |b> against one
+    transfer matrix shared by all of them."""
+    rng = np.random.default_rng(seed)
+    C = 2*math.pi / (2**register_size * t)
+    A, _ = random_problem(memory_size, register_size, t, rng)
+    shape = (num_rhs, 2**memory_size)
+    bs = rng.normal(size=shape) + 1j*rng.normal(size=shape)
+    bs /= np.linalg.norm(bs, axis=1, keepdims=True)
+
+    start = time.perf_counter()
+    expected = [solution_density_matrix(hhl_circuit(
+        A, C, t, register_size, state_prep_gate(b),
+        trotter_steps=trotter_steps)) for b in bs]
+    per_circuit = time.perf_counter() - start
+
+    start = time.perf_counter()
+    transfer_matrix = hhl_transfer_matrix(A, C, t, register_size,
+                                          trotter_steps)
+    built = time.perf_counter() - start
+    rho, _ = solve_batch(transfer_matrix, bs)
+    batched = time.perf_counter() - start
+
+    print("{} right-hand sides, m = {}".format(num_rhs, memory_size))
+    print("one circuit per b: {:.2f} s".format(per_circuit))
+    print("transfer matrix:   {:.2f} s ({:.2f} s to build)".format(
+        batched, built))
+    print("max difference:    {:.2e}".format(
+        np.max(np.abs(rho - np.array(expected)))))
+
+
+if __name__ == '__main__':
+    benchmark_eigen_rotation()
+    print()
+    benchmark_memory_size()
+    print()
+    benchmark_batch_solve()
@@ -16,13 +16,22 @@ following are performed in order:
 2) Controlled rotations of ancilla qubit
 3) Uncomputation with inverse quantum phase estimation
 
+Only runs where the ancilla is measured as 1 produce |x>. The probability of
+this is roughly (C/λ)², which is small when C is small compared to the
+eigenvalues of A. Steps 1-3 can optionally be followed by rounds of amplitude
+amplification, which raise the probability of measuring the ancilla as 1 to
+near 1, so that few shots are discarded.
+
 For details about the algorithm, please refer to papers in the
 REFERENCE section below. The following description uses variables defined
 in the HHL paper.
 
-This example is an implementation of the HHL algorithm for arbitrary 2x2
-Hermitian matrices. The output of the algorithm are the expectation values
-of Pauli observables of |x>. Note that the accuracy of the result depends
+This example is an implementation of the HHL algorithm for arbitrary
+2^m x 2^m Hermitian matrices, with |b> and |x> stored in m memory qubits. For
+2x2 matrices e^iAt is applied exactly; larger matrices are decomposed into a
+sum of Pauli strings and e^iAt is approximated with a Trotter–Suzuki product.
+The output of the algorithm are the expectation values of Pauli observables
+of |x>. Note that the accuracy of the result depends
 on the following factors:
 * Register size
 * Choice of parameters C and t
@@ -45,6 +54,9 @@ t = 2π/sN
 
 For arbitrary matrices, because properties of their eigenvalues are typically
 unknown, parameters C and t are fine-tuned based on their condition number.
+`tune_hhl` automates this: it sweeps candidate values of t for increasing
+register sizes, sets C to the smallest eigenvalue that can be stored, and
+returns the smallest register which reaches a target fidelity.
 
 
 === REFERENCE ===
@@ -55,6 +67,9 @@ https://arxiv.org/abs/0811.3171
 Coles, Eidenbenz et al. Quantum Algorithm Implementations for Beginners
 https://arxiv.org/abs/1804.03719
 
+Brassard, Høyer, Mosca, Tapp. Quantum Amplitude Amplification and Estimation
+https://arxiv.org/abs/quant-ph/0005055
+
 === CIRCUIT ===
 Example of circuit with 2 register qubits.
 
@@ -70,7 +85,12 @@ Note: QFT in the above diagram omits swaps, which are included implicitly by
 reversing qubit order for phase kickbacks.
 """
 
+import collections
+import concurrent.futures
+import functools
+import itertools
 import math
+import warnings
 import numpy as np
 import sympy
 import cirq
@@ -81,8 +101,8 @@ class PhaseEstimation(cirq.Gate):
     A gate for Quantum Phase Estimation.
 
     unitary is the unitary gate whose phases will be estimated.
-    The last qubit stores the eigenvector; all other qubits store the
-    estimated phase, in big-endian.
+    The last qubits, as many as unitary acts on, store the eigenvector; all
+    other qubits store the estimated phase, in big-endian.
     """
 
     def __init__(self, num_qubits, unitary):
@@ -94,9 +114,10 @@ class PhaseEstimation(cirq.Gate):
 
     def _decompose_(self, qubits):
         qubits = list(qubits)
-        yield cirq.H.on_each(*qubits[:-1])
+        register = qubits[:-cirq.num_qubits(self.U)]
+        yield cirq.H.on_each(*register)
         yield PhaseKickback(self.num_qubits(), self.U)(*qubits)
-        yield cirq.qft(*qubits[:-1], without_reverse=True)**-1
+        yield cirq.qft(*register, without_reverse=True)**-1
 
 
 class HamiltonianSimulation(cirq.EigenGate, cirq.SingleQubitGate):
@@ -107,6 +128,11 @@ class HamiltonianSimulation(cirq.EigenGate, cirq.SingleQubitGate):
     purely for demonstrative purposes. If a large matrix is used,
     the circuit should implement actual Hamiltonian simulation,
     by using the linear operators framework in Cirq for example.
+
+    The eigendecomposition of A is computed once per (A, t) and shared by all
+    exponentiated copies of the gate, such as those in the phase kickback and
+    its inverse. The unitary of each power is memoized by (A, t, exponent).
+    Both caches keep only the most recently used entries.
     """
 
     def __init__(self, A, t, exponent=1.0):
@@ -114,12 +140,9 @@ class HamiltonianSimulation(cirq.EigenGate, cirq.SingleQubitGate):
         cirq.EigenGate.__init__(self, exponent=exponent)
         self.A = A
         self.t = t
-        ws, vs = np.linalg.eigh(A)
-        self.eigen_components = []
-        for w, v in zip(ws, vs.T):
-            theta = w*t / math.pi
-            P = np.outer(v, np.conj(v))
-            self.eigen_components.append((theta, P))
+        self._key = _matrix_key(A) + (t,)
+        self._ws, self._vs, self.eigen_components = _eigendecomposition(
+            *self._key)
 
     def _with_exponent(self, exponent):
         return HamiltonianSimulation(self.A, self.t, exponent)
@@ -127,13 +150,149 @@ class HamiltonianSimulation(cirq.EigenGate, cirq.SingleQubitGate):
     def _eigen_components(self):
         return self.eigen_components
 
+    def _unitary_(self):
+        if cirq.is_parameterized(self):
+            return NotImplemented
+        return _simulation_unitary(*self._key, float(self.exponent))
+
+
+# Number of entries kept by each of the caches of matrix computations below.
+CACHE_SIZE = 64
+
+
+def _matrix_key(A):
+    """Returns a hashable key for the entries of a matrix."""
+    A = np.asarray(A)
+    return (A.tobytes(), A.shape, A.dtype.str)
+
+
+def _from_key(data, shape, dtype):
+    return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _eigendecomposition(data, shape, dtype, t):
+    """Returns the eigenvalues, eigenvectors and eigen components of e^iAt
+    for the matrix with key (data, shape, dtype)."""
+    ws, vs = np.linalg.eigh(_from_key(data, shape, dtype))
+    eigen_components = []
+    for w, v in zip(ws, vs.T):
+        theta = w*t / math.pi
+        P = np.outer(v, np.conj(v))
+        eigen_components.append((theta, P))
+    return ws, vs, eigen_components
+
+
+@functools.lru_cache(maxsize=4 * CACHE_SIZE)
+def _simulation_unitary(data, shape, dtype, t, exponent):
+    """Returns the unitary of e^iAt raised to the exponent."""
+    ws, vs, _ = _eigendecomposition(data, shape, dtype, t)
+    phases = np.exp(1j * ws * t * exponent)
+    return (vs * phases) @ vs.conj().T
+
+
+class TrotterHamiltonianSimulation(cirq.Gate):
+    """
+    A gate that approximates e^iAt for a 2^m x 2^m Hermitian matrix A.
+
+    A is decomposed into a sum of Pauli strings, A = Σ c_P P, and e^iAt is
+    approximated by second-order Trotter–Suzuki steps, each of which applies
+    e^(i c_P P t/2r) for every term and then again in reverse order. The
+    number of steps r is steps per unit of exponent, so that powers of the
+    gate keep the same accuracy. The identity term is a global phase, which
+    matters once the gate is controlled; controlled() returns a
+    `ControlledTrotterHamiltonianSimulation`, which only controls the
+    rotations themselves.
+    """
+
+    def __init__(self, A, t, steps=1, exponent=1.0, terms=None):
+        self._num_qubits = int(round(math.log2(len(A))))
+        self.A = A
+        self.t = t
+        self.steps = steps
+        self.exponent = exponent
+        self.terms = pauli_decomposition(A) if terms is None else terms
+
+    def num_qubits(self):
+        return self._num_qubits
+
+    def __pow__(self, exponent):
+        return TrotterHamiltonianSimulation(self.A, self.t, self.steps,
+                                            self.exponent * exponent,
+                                            self.terms)
+
+    def controlled(self, num_controls=None, control_values=None,
+                   control_qid_shape=None):
+        if (num_controls in (None, 1) and control_values is None
+                and control_qid_shape is None):
+            return ControlledTrotterHamiltonianSimulation(self)
+        return super().controlled(num_controls, control_values,
+                                  control_qid_shape)
+
+    def _identity_phase(self):
+        """Returns the phase of the identity term, c_I t times the
+        exponent."""
+        identity = 'I' * self._num_qubits
+        return self.terms.get(identity, 0) * self.t * self.exponent
+
+    def _rotations(self):
+        """Returns the (Pauli string, angle) pairs of the Trotter product,
+        without the identity term."""
+        identity = 'I' * self._num_qubits
+        terms = [(P, c) for P, c in self.terms.items() if P != identity]
+        num_steps = max(1, int(math.ceil(self.steps * abs(self.exponent))))
+        tau = self.t * self.exponent / num_steps
+        half_step = terms + terms[::-1]
+
+        # Merge the repeated terms where the halves and the steps meet.
+        rotations = []
+        for P, c in half_step * num_steps:
+            if rotations and rotations[-1][0] == P:
+                rotations[-1][1] += c * tau / 2
+            else:
+                rotations.append([P, c * tau / 2])
+        return rotations
+
+    def _decompose_(self, qubits):
+        phase = self._identity_phase()
+        if phase:
+            yield cirq.global_phase_operation(np.exp(1j * phase))
+        yield pauli_rotations(qubits, self._rotations())
+
+
+class ControlledTrotterHamiltonianSimulation(cirq.Gate):
+    """
+    TrotterHamiltonianSimulation controlled by the first qubit.
+
+    Only the Rz of each Pauli rotation needs the control: the basis changes
+    and parity CNOTs around it cancel when it is not applied. The phase of
+    the identity term becomes a phase gate on the control qubit.
+    """
+
+    def __init__(self, sub_gate):
+        self.sub_gate = sub_gate
+
+    def num_qubits(self):
+        return self.sub_gate.num_qubits() + 1
+
+    def __pow__(self, exponent):
+        return ControlledTrotterHamiltonianSimulation(
+            self.sub_gate**exponent)
+
+    def _decompose_(self, qubits):
+        control, qubits = qubits[0], qubits[1:]
+        phase = self.sub_gate._identity_phase()
+        if phase:
+            yield cirq.Z(control)**(phase / math.pi)
+        yield pauli_rotations(qubits, self.sub_gate._rotations(), control)
+
 
 class PhaseKickback(cirq.Gate):
     """
     A gate for the phase kickback stage of Quantum Phase Estimation.
 
-    It consists of a series of controlled e^iAt gates with the memory qubit as
-    the target and each register qubit as the control, raised
+    It consists of a series of controlled e^iAt gates with the memory qubits
+    as the target and each register qubit as the control, raised
     to the power of 2 based on the qubit index.
     unitary is the unitary gate whose phases will be estimated.
     """
@@ -148,9 +307,10 @@ class PhaseKickback(cirq.Gate):
 
     def _decompose_(self, qubits):
         qubits = list(qubits)
-        memory = qubits.pop()
-        for i, qubit in enumerate(qubits):
-            yield cirq.ControlledGate(self.U**(2**i))(qubit, memory)
+        memory_size = cirq.num_qubits(self.U)
+        memory = qubits[-memory_size:]
+        for i, qubit in enumerate(qubits[:-memory_size]):
+            yield (self.U**(2**i)).controlled()(qubit, *memory)
 
 
 class EigenRotation(cirq.Gate):
@@ -164,19 +324,30 @@ class EigenRotation(cirq.Gate):
     that can be represented by the register. Each rotation is a Ry gate where
     the angle is calculated from the eigenvalue corresponding to the register
     value, up to a normalization factor C.
+
+    By default the rotations are decomposed as a single uniformly controlled
+    (multiplexed) Ry, using N CNOTs and N single-qubit Ry gates for N possible
+    register values. With multiplexed=False, one multi-controlled Ry is used
+    per register value instead.
     """
 
-    def __init__(self, num_qubits, C, t):
+    def __init__(self, num_qubits, C, t, multiplexed=True):
         super(EigenRotation, self)
         self._num_qubits = num_qubits
         self.C = C
         self.t = t
         self.N = 2**(num_qubits-1)
+        self.multiplexed = multiplexed
 
     def num_qubits(self):
         return self._num_qubits
 
     def _decompose_(self, qubits):
+        if self.multiplexed:
+            return self._multiplexed_rotation(qubits)
+        return self._controlled_rotations(qubits)
+
+    def _controlled_rotations(self, qubits):
         for k in range(self.N):
             kGate = self._ancilla_rotation(k)
 
@@ -194,65 +365,246 @@ class EigenRotation(cirq.Gate):
 
             yield kGate(*qubits)
 
-    def _ancilla_rotation(self, k):
+    def _multiplexed_rotation(self, qubits):
+        """
+        Decomposes the rotations as alternating Ry gates and CNOTs, following
+        Möttönen et al. (https://arxiv.org/abs/quant-ph/0407010).
+
+        The CNOT controls follow a Gray code, so before the i-th Ry the
+        ancilla has been flipped by the parity of the register bits selected
+        by gray(i). The Ry angles therefore satisfy
+        angle(k) = Σ_i (-1)^(k·gray(i)) θ_i, which is inverted with a
+        Walsh–Hadamard transform.
+        """
+        register, ancilla = qubits[:-1], qubits[-1]
+        thetas = _walsh_hadamard(
+            [self._rotation_angle(k) for k in range(self.N)]) / self.N
+
+        for i in range(self.N):
+            gray = i ^ (i >> 1)
+            yield cirq.ry(thetas[gray])(ancilla)
+
+            # The bit which changes in the next Gray code word, wrapping
+            # around to 0 at the end.
+            next_i = (i + 1) % self.N
+            bit = (gray ^ next_i ^ (next_i >> 1)).bit_length() - 1
+            yield cirq.CNOT(register[-1 - bit], ancilla)
+
+    def _rotation_angle(self, k):
         if k == 0:
             k = self.N
-        theta = 2*math.asin(self.C * self.N * self.t / (2*math.pi * k))
-        return cirq.ry(theta)
+        # C = 2π/(tN) gives exactly 1 for k = 1, up to rounding.
+        return 2*math.asin(
+            min(1.0, self.C * self.N * self.t / (2*math.pi * k)))
+
+    def _ancilla_rotation(self, k):
+        return cirq.ry(self._rotation_angle(k))
+
+
+def pauli_decomposition(A, tol=1e-12):
+    """
+    Returns the Pauli decomposition A = Σ c_P P of a 2^m x 2^m Hermitian
+    matrix as a dict from strings such as 'XZ' to the real coefficients c_P.
+    The first letter acts on the most significant qubit, and terms with
+    |c_P| <= tol are dropped.
+
+    c_P = tr(PA) / 2^m is computed one qubit at a time, by splitting each
+    block into 2x2 blocks of sub-matrices.
+    """
+    m = int(round(math.log2(len(A))))
+    paulis = np.array([[[1, 0], [0, 1]],
+                       [[0, 1], [1, 0]],
+                       [[0, -1j], [1j, 0]],
+                       [[1, 0], [0, -1]]])
+    blocks = np.asarray(A, dtype=complex).reshape(1, 2**m, 2**m)
+    for _ in range(m):
+        num_blocks, d = blocks.shape[0], blocks.shape[1] // 2
+        blocks = blocks.reshape(num_blocks, 2, d, 2, d)
+        blocks = np.einsum('pji,liajb->lpab', paulis, blocks) / 2
+        blocks = blocks.reshape(4 * num_blocks, d, d)
+
+    labels = (''.join(P) for P in itertools.product('IXYZ', repeat=m))
+    return {P: c.real for P, c in zip(labels, blocks.reshape(-1))
+            if abs(c) > tol}
+
+
+def pauli_rotations(qubits, rotations, control=None):
+    """
+    Yields operations implementing the product of e^(i angle P) for the
+    (P, angle) pairs in rotations, applied in order, where each Pauli string
+    P is given as a string such as 'XZ', one letter per qubit.
+
+    Each factor is rotated into the Z basis, the parity is computed onto the
+    last qubit with CNOTs and rotated with Rz, controlled by the control
+    qubit if one is given. A qubit is only rotated back to the Z basis when
+    a later string needs another basis on it, so the basis changes between
+    consecutive rotations cancel.
+    """
+    to_basis = {'X': lambda q: [cirq.H(q)],
+                'Y': lambda q: [cirq.S(q)**-1, cirq.H(q)]}
+    basis = {}
+    for paulis, angle in rotations:
+        active = [(q, P) for q, P in zip(qubits, paulis) if P != 'I']
+        if not active:
+            continue
+        for q, P in active:
+            if basis.get(q, 'Z') != P:
+                if basis.get(q, 'Z') != 'Z':
+                    yield cirq.inverse(to_basis[basis[q]](q))
+                if P != 'Z':
+                    yield to_basis[P](q)
+                basis[q] = P
+        parity = [cirq.CNOT(a, b)
+                  for (a, _), (b, _) in zip(active, active[1:])]
+        rotation = cirq.rz(-2 * angle)
+        if control is not None:
+            rotation = rotation.controlled()(control, active[-1][0])
+        else:
+            rotation = rotation(active[-1][0])
+
+        yield parity
+        yield rotation
+        yield cirq.inverse(parity)
+    for q, P in basis.items():
+        if P != 'Z':
+            yield cirq.inverse(to_basis[P](q))
+
+
+def _walsh_hadamard(values):
+    """
+    Returns the Walsh–Hadamard transform of values, whose length must be a
+    power of 2: out[j] = Σ_k (-1)^(popcount(j & k)) values[k].
+    """
+    values = np.array(values, dtype=float)
+    h = 1
+    while h < len(values):
+        pairs = values.reshape(-1, 2, h)
+        values = np.stack((pairs[:, 0] + pairs[:, 1],
+                           pairs[:, 0] - pairs[:, 1]), axis=1).reshape(-1)
+        h *= 2
+    return values
+
+
+def amplification_round(ancilla, qubits, state_prep):
+    """
+    Yields one round of amplitude amplification, Q = -A S_0 A^-1 S_χ.
+
+    state_prep is the list of operations A which prepares the HHL state from
+    |0...0>; S_χ flips the sign of the states with the ancilla set to 1 and
+    S_0 flips the sign of |0...0> on all qubits. The overall sign of Q is a
+    global phase and is omitted.
+    """
+    yield cirq.Z(ancilla)
+    yield cirq.inverse(state_prep)
+    yield cirq.X.on_each(*qubits)
+    yield cirq.ControlledGate(cirq.Z, num_controls=len(qubits)-1)(*qubits)
+    yield cirq.X.on_each(*qubits)
+    yield state_prep
+
+
+def amplification_rounds(success_probability):
+    """
+    Returns the number of amplitude amplification rounds that maximizes the
+    probability of measuring the ancilla as 1.
+
+    After k rounds, the probability is sin²((2k+1)θ), where
+    sin²θ = success_probability is the probability without amplification.
+    """
+    if success_probability <= 0:
+        return 0
+    theta = math.asin(math.sqrt(min(success_probability, 1)))
+    return max(0, int(round(math.pi / (4*theta) - 0.5)))
 
 
-def hhl_circuit(A, C, t, register_size, *input_prep_gates):
+def hhl_operations(A, C, t, ancilla, register, memory, trotter_steps=None):
+    """
+    Returns the operations of HHL which depend on A: phase estimation, the
+    ancilla rotation and the inverse phase estimation. See `hhl_circuit` for
+    the arguments.
+    """
+    if trotter_steps is None and len(memory) == 1:
+        hs = HamiltonianSimulation(A, t)
+    else:
+        hs = TrotterHamiltonianSimulation(A, t, trotter_steps or 1)
+    pe = PhaseEstimation(len(register) + len(memory), hs)
+    return [
+        pe(*(register + memory)),
+        EigenRotation(len(register) + 1, C, t)(*(register + [ancilla])),
+        pe(*(register + memory))**-1,
+    ]
+
+
+def hhl_circuit(A, C, t, register_size, *input_prep_gates,
+                rounds=0, trotter_steps=None):
     """
     Constructs the HHL circuit.
 
     Args:
-        A: The input Hermitian matrix.
+        A: The input 2^m x 2^m Hermitian matrix.
         C: Algorithm parameter, see above.
         t: Algorithm parameter, see above.
         register_size: The size of the eigenvalue register.
         memory_basis: The basis to measure the memory in, one of 'x', 'y', 'z'.
         input_prep_gates: A list of gates to be applied to |0> to generate the
-            desired input state |b>.
+            desired input state |b>. Each gate acts on all m memory qubits.
+        rounds: The number of amplitude amplification rounds applied before
+            measuring the ancilla, see `amplification_rounds`.
+        trotter_steps: The number of Trotter–Suzuki steps per unit exponent
+            of e^iAt, see `TrotterHamiltonianSimulation`. If None, 2x2
+            matrices use the exact `HamiltonianSimulation` and larger ones a
+            single step.
 
     Returns:
         The HHL circuit. The ancilla measurement has key 'a' and the memory
         measurement is in key 'm'.  There are two parameters in the circuit,
         `exponent` and `phase_exponent` corresponding to a possible rotation
-        applied before the measurement on the memory with a
+        applied before the measurement on each memory qubit with a
         `cirq.PhasedXPowGate`.
     """
 
+    memory_size = int(round(math.log2(len(A))))
     ancilla = cirq.LineQubit(0)
     # to store eigenvalues of the matrix
     register = [cirq.LineQubit(i + 1) for i in range(register_size)]
     # to store input and output vectors
-    memory = cirq.LineQubit(register_size + 1)
+    memory = [cirq.LineQubit(register_size + 1 + i)
+              for i in range(memory_size)]
 
     c = cirq.Circuit()
-    hs = HamiltonianSimulation(A, t)
-    pe = PhaseEstimation(register_size+1, hs)
-    c.append([gate(memory) for gate in input_prep_gates])
-    c.append([
-        pe(*(register + [memory])),
-        EigenRotation(register_size + 1, C, t)(*(register + [ancilla])),
-        pe(*(register + [memory]))**-1,
-        cirq.measure(ancilla, key='a')
-    ])
+    state_prep = [gate(*memory) for gate in input_prep_gates]
+    state_prep += hhl_operations(A, C, t, ancilla, register, memory,
+                                 trotter_steps)
+    c.append(state_prep)
+    for _ in range(rounds):
+        c.append(amplification_round(
+            ancilla, [ancilla] + register + memory, state_prep))
+    c.append(cirq.measure(ancilla, key='a'))
 
     c.append([
         cirq.PhasedXPowGate(
             exponent=sympy.Symbol('exponent'),
-            phase_exponent=sympy.Symbol('phase_exponent'))(memory),
-        cirq.measure(memory, key='m')
+            phase_exponent=sympy.Symbol('phase_exponent')).on_each(*memory),
+        cirq.measure(*memory, key='m')
     ])
 
     return c
 
 
-def simulate(circuit):
+def success_probability(circuit, repetitions=200):
+    """
+    Estimates the probability of measuring the ancilla as 1 from a short run
+    of the circuit.
+    """
     simulator = cirq.Simulator()
+    params = {'exponent': 0, 'phase_exponent': 0}
+    result = simulator.run(circuit, params, repetitions=repetitions)
+    return np.mean(result.measurements['a'])
 
-    # Cases for measuring X, Y, and Z (respectively) on the memory qubit.
+
+def simulate(circuit, repetitions=5000):
+    simulator = cirq.Simulator()
+
+    # Cases for measuring X, Y, and Z (respectively) on each memory qubit.
     params = [{
         'exponent': 0.5,
         'phase_exponent': -0.5
@@ -264,14 +616,248 @@ def simulate(circuit):
         'phase_exponent': 0
     }]
 
-    results = simulator.run_sweep(circuit, params, repetitions=5000)
+    results = simulator.run_sweep(circuit, params, repetitions=repetitions)
 
     for label, result in zip(('X', 'Y', 'Z'), list(results)):
         # Only select cases where the ancilla is 1.
-        # TODO optimize using amplitude amplification algorithm
+        selected = result.measurements['a'][:, 0] == 1
         expectation = 1 - 2 * np.mean(
-            result.measurements['m'][result.measurements['a'] == 1])
+            result.measurements['m'][selected], axis=0)
+        print('{} = {} (kept {:.1%} of shots)'.format(
+            label, np.squeeze(expectation), np.mean(selected)))
+
+
+def solution_density_matrix(circuit):
+    """
+    Returns the normalized density matrix of the memory qubits conditioned on
+    measuring the ancilla as 1, computed exactly without sampling.
+
+    The circuit is simulated once up to the memory measurement. The final
+    state is projected onto ancilla=1 and the register is traced out.
+    """
+    # Drop the measurements and the rotation before the memory measurement,
+    # leaving the unitary part of the circuit.
+    unitary_part = cirq.Circuit(
+        op for op in circuit.all_operations()
+        if not cirq.is_measurement(op) and not cirq.is_parameterized(op))
+    memory_size = next(
+        len(op.qubits) for op in circuit.all_operations()
+        if cirq.is_measurement(op) and cirq.measurement_key_name(op) == 'm')
+
+    # The ancilla is the first qubit and the memory qubits are the last ones.
+    simulator = cirq.Simulator(dtype=np.complex128)
+    result = simulator.simulate(unitary_part,
+                                qubit_order=sorted(circuit.all_qubits()))
+    state = result.final_state_vector.reshape(2, -1, 2**memory_size)
+
+    # Project onto ancilla=1 and trace out the register.
+    projected = state[1]
+    rho = projected.T @ projected.conj()
+    return rho / np.trace(rho)
+
+
+def pauli_expectations(rho):
+    """
+    Returns the X, Y and Z expectations of each qubit for density matrices
+    rho of shape (..., 2^m, 2^m), as an array of shape (3, ..., m).
+    """
+    memory_size = int(round(math.log2(rho.shape[-1])))
+    batch_shape = rho.shape[:-2]
+    rho = rho.reshape(batch_shape + (2,) * (2 * memory_size))
+    batch_dims = len(batch_shape)
+
+    reduced = []
+    for i in range(memory_size):
+        # Reduced density matrix of memory qubit i.
+        rho_i = rho
+        for j in reversed(range(memory_size)):
+            if j != i:
+                row_axis = batch_dims + j
+                column_axis = row_axis + (rho_i.ndim - batch_dims) // 2
+                rho_i = np.trace(rho_i, axis1=row_axis, axis2=column_axis)
+        reduced.append(rho_i)
+    reduced = np.stack(reduced, axis=-3)
+
+    paulis = np.array([[[0, 1], [1, 0]],
+                       [[0, -1j], [1j, 0]],
+                       [[1, 0], [0, -1]]])
+    return np.real(np.einsum('pji,...ij->p...', paulis, reduced))
+
+
+def simulate_exact(circuit):
+    """
+    Computes the Pauli observables of each qubit of |x> exactly, without
+    sampling, from `solution_density_matrix`.
+    """
+    expectations = pauli_expectations(solution_density_matrix(circuit))
+    expectations = [np.squeeze(expectation) for expectation in expectations]
+    for label, expectation in zip(('X', 'Y', 'Z'), expectations):
         print('{} = {}'.format(label, expectation))
+    return expectations
+
+
+def hhl_transfer_matrix(A, C, t, register_size, trotter_steps=None):
+    """
+    Returns the linear map taking |b> to the unnormalized state of the
+    register and memory after HHL, with the ancilla measured as 1.
+
+    The map is an array of shape (2^n, 2^m, 2^m) for n register qubits and
+    m memory qubits, indexed by the register value, the output memory value
+    and the input memory value. It is computed with a single simulation of
+    the A-dependent part of the circuit, with the memory maximally entangled
+    with m reference qubits, so that every input |j> is processed at once.
+    """
+    memory_size = int(round(math.log2(len(A))))
+    ancilla = cirq.LineQubit(0)
+    register = [cirq.LineQubit(i + 1) for i in range(register_size)]
+    memory = [cirq.LineQubit(register_size + 1 + i)
+              for i in range(memory_size)]
+    reference = [cirq.LineQubit(register_size + 1 + memory_size + i)
+                 for i in range(memory_size)]
+
+    c = cirq.Circuit()
+    c.append(cirq.H.on_each(*reference))
+    c.append(cirq.CNOT(r, q) for r, q in zip(reference, memory))
+    c.append(hhl_operations(A, C, t, ancilla, register, memory,
+                            trotter_steps))
+
+    simulator = cirq.Simulator(dtype=np.complex128)
+    result = simulator.simulate(c, qubit_order=[ancilla] + register +
+                                memory + reference)
+    state = result.final_state_vector.reshape(
+        2, 2**register_size, 2**memory_size, 2**memory_size)
+    return state[1] * np.sqrt(2**memory_size)
+
+
+def solve_batch(transfer_matrix, bs):
+    """
+    Applies the map from `hhl_transfer_matrix` to a stack of vectors b of
+    shape (k, 2^m), which are normalized first.
+
+    Returns:
+        The normalized density matrices of |x> for each b, of shape
+        (k, 2^m, 2^m), and the probabilities of measuring the ancilla as 1.
+    """
+    bs = np.atleast_2d(bs)
+    bs = bs / np.linalg.norm(bs, axis=1, keepdims=True)
+    states = np.einsum('roj,kj->kro', transfer_matrix, bs)
+    probabilities = np.sum(np.abs(states)**2, axis=(1, 2))
+    rho = np.einsum('kro,krp->kop', states, states.conj())
+    return rho / probabilities[:, None, None], probabilities
+
+
+def spectral_bounds(A):
+    """Returns the smallest and the largest eigenvalue of A."""
+    return _spectral_bounds(*_matrix_key(A))
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _spectral_bounds(data, shape, dtype):
+    ws = np.linalg.eigvalsh(_from_key(data, shape, dtype))
+    return ws[0], ws[-1]
+
+
+def hhl_parameters(lambda_max, register_size, fraction=1.0):
+    """
+    Returns t and C for eigenvalues up to lambda_max.
+
+    The largest t for which lambda_max still rounds to a register value below
+    N is scaled by fraction, and C is set to the smallest eigenvalue that can
+    be represented by the register, 2π/(tN).
+    """
+    N = 2**register_size
+    t = fraction * 2*math.pi * (N - 0.5) / (N * lambda_max)
+    return t, 2*math.pi / (N * t)
+
+
+HHLSetting = collections.namedtuple(
+    'HHLSetting',
+    ['register_size', 't', 'C', 'fidelity', 'success_probability'])
+
+
+def _evaluate_setting(A, bs, register_size, t, C, trotter_steps):
+    """Returns the mean fidelity and success probability of one setting."""
+    rho, probabilities = solve_batch(
+        hhl_transfer_matrix(A, C, t, register_size, trotter_steps), bs)
+    xs = np.linalg.solve(A, np.atleast_2d(bs).T).T
+    xs /= np.linalg.norm(xs, axis=1, keepdims=True)
+    fidelities = np.real(np.einsum('ko,kop,kp->k', xs.conj(), rho, xs))
+    return HHLSetting(register_size, t, C, np.mean(fidelities),
+                      np.mean(probabilities))
+
+
+def tune_hhl(A, bs=None, target_fidelity=0.99, max_register_size=8,
+             fractions=(0.9, 0.8, 0.7, 0.6), trotter_steps=None,
+             max_workers=None, seed=0):
+    """
+    Picks t, C and the smallest register size for which HHL reaches a target
+    fidelity with the solution of Ax = b.
+
+    Every register qubit doubles the cost of simulation, so register sizes
+    are tried in increasing order. For each size, one value of t per entry of
+    fractions is evaluated (see `hhl_parameters`), in parallel over a process
+    pool, using the exact transfer matrix of the circuit.
+
+    Args:
+        A: The input 2^m x 2^m Hermitian matrix, which must be positive
+            definite.
+        bs: The right-hand sides to average the fidelity over. If None, 8
+            random vectors are used.
+        target_fidelity: The mean fidelity to reach.
+        max_register_size: The largest register size to try.
+        fractions: The fractions of the largest usable t to try. At 1.0,
+            lambda_max lies halfway between the last register value and
+            the wrap-around to 0, so the default starts below it.
+        trotter_steps: See `hhl_circuit`.
+        max_workers: The size of the process pool.
+        seed: The seed of the random right-hand sides.
+
+    Returns:
+        The best setting, as an `HHLSetting`, and the list of every setting
+        evaluated, as a report of accuracy against cost. A RuntimeWarning is
+        issued if no setting reaches target_fidelity, in which case the best
+        setting evaluated is returned.
+    """
+    lambda_min, lambda_max = spectral_bounds(A)
+    if lambda_min <= 0:
+        raise ValueError('HHL needs a positive definite matrix, but the '
+                         'smallest eigenvalue is {}.'.format(lambda_min))
+    if bs is None:
+        rng = np.random.default_rng(seed)
+        bs = rng.normal(size=(8, len(A))) + 1j*rng.normal(size=(8, len(A)))
+
+    report = []
+    best = None
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        for register_size in range(1, max_register_size + 1):
+            candidates = [hhl_parameters(lambda_max, register_size, fraction)
+                          for fraction in fractions]
+            settings = executor.map(
+                _evaluate_setting,
+                *zip(*[(A, bs, register_size, t, C, trotter_steps)
+                       for t, C in candidates]))
+            report.extend(settings)
+            best = max(report, key=lambda setting: setting.fidelity)
+            if best.fidelity >= target_fidelity:
+                break
+    if best.fidelity < target_fidelity:
+        warnings.warn('HHL reached a fidelity of {:.5f}, below the target of '
+                      '{}, with registers of up to {} qubits.'.format(
+                          best.fidelity, target_fidelity, max_register_size),
+                      RuntimeWarning)
+    return best, report
+
+
+def print_tuning_report(report):
+    """
+    Prints the settings evaluated by `tune_hhl`, with the number of shots
+    needed per accepted shot without amplitude amplification.
+    """
+    print("{:>4} {:>9} {:>9} {:>9} {:>9} {:>7}".format(
+        "n", "t", "C", "fidelity", "P(a=1)", "shots"))
+    for setting in report:
+        print("{:>4} {:>9.5f} {:>9.5f} {:>9.5f} {:>9.5f} {:>7.1f}".format(
+            *setting, 1 / setting.success_probability))
 
 
 def main():
@@ -310,6 +896,38 @@ def main():
     print("Actual: ")
     simulate(hhl_circuit(A, C, t, register_size, *input_prep_gates))
 
+    print("Exact: ")
+    simulate_exact(hhl_circuit(A, C, t, register_size, *input_prep_gates))
+
+    # Solve for several |b> against the same A with one simulation.
+    bs = np.array([[0.64510-0.47848j, 0.35490-0.47848j],
+                   [1, 0],
+                   [0, 1],
+                   [1, 1]])
+    rho, _ = solve_batch(hhl_transfer_matrix(A, C, t, register_size), bs)
+    print("Batch of {} right-hand sides (X, Y, Z):".format(len(bs)))
+    for b, observables in zip(bs, pauli_expectations(rho)[..., 0].T):
+        print(b, observables)
+
+    # Pick t, C and the register size automatically.
+    best, report = tune_hhl(A, bs=bs[:1], target_fidelity=0.999)
+    print("Tuning report:")
+    print_tuning_report(report)
+    print("Chosen: register size {}, t = {:.5f}, C = {:.5f}".format(
+        *best[:3]))
+
+    # A smaller C lowers the probability of measuring the ancilla as 1.
+    # Amplitude amplification recovers it, so that few shots are wasted.
+    # The probability scales with C², so it is estimated at the larger C,
+    # where few shots suffice, and rescaled.
+    p = success_probability(
+        hhl_circuit(A, C, t, register_size, *input_prep_gates)) / 16
+    C = C / 4
+    rounds = amplification_rounds(p)
+    print("Actual with C/4 and {} amplification round(s): ".format(rounds))
+    simulate(hhl_circuit(A, C, t, register_size, *input_prep_gates,
+                         rounds=rounds), repetitions=1000)
+
 
 if __name__ == '__main__':
     main()
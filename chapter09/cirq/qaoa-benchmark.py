@@ -0,0 +1,140 @@
+"""Benchmarks for the QAOA example in qaoa.py."""
+
+# Imports
+import time
+
+import numpy as np
+import cirq
+
+import qaoa
+
+
+def benchmark_landscape(ngamma=50, nbeta=75):
+    """Compares the vectorized landscape with simulating the Cirq circuit at
+    every grid point."""
+    gammavals = np.linspace(0, 1.0, ngamma)
+    betavals = np.linspace(0, np.pi, nbeta)
+
+    start = time.perf_counter()
+    expected = qaoa.grid_search_cirq(gammavals, betavals)
+    cirq_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    costmat = qaoa.landscape(gammavals, betavals)
+    numpy_time = time.perf_counter() - start
+
+    print("Landscape of {} x {} points on a {} x {} grid".format(
+        ngamma, nbeta, qaoa.nrows, qaoa.ncols))
+    print("Cirq:       {:.3f} s".format(cirq_time))
+    print("Vectorized: {:.3f} s ({:.0f}x faster)".format(
+        numpy_time, cirq_time / numpy_time))
+    print("Max difference: {:.2e}".format(np.max(np.abs(costmat - expected))))
+
+
+def benchmark_cost_layer(gamma=0.3, beta=0.7, repeats=20):
+    """Compares the cost layer built from single ZZPowGates with the one
+    built from four CZ gates per edge."""
+    qubits = [q for row in qaoa.qreg for q in row]
+    native = qaoa.qaoa([gamma], [beta])
+    with_cz = cirq.Circuit(cirq.H.on_each(*qubits))
+    for i in range(qaoa.nrows):
+        for j in range(qaoa.ncols):
+            if i < qaoa.nrows - 1:
+                with_cz += qaoa.ZZ_cz(qaoa.qreg[i][j], qaoa.qreg[i + 1][j],
+                                      gamma)
+            if j < qaoa.ncols - 1:
+                with_cz += qaoa.ZZ_cz(qaoa.qreg[i][j], qaoa.qreg[i][j + 1],
+                                      gamma)
+    with_cz.append(qaoa.mixer(beta))
+
+    print("QAOA circuit for p = 1 on a {} x {} grid".format(
+        qaoa.nrows, qaoa.ncols))
+    for label, circuit in (("ZZPowGate", native), ("CZ", with_cz)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            qaoa.simulate(circuit)
+        elapsed = (time.perf_counter() - start) / repeats
+        print("{:>10}: {:>4} operations, {:>3} moments, {:.4f} s".format(
+            label, len(list(circuit.all_operations())), len(circuit),
+            elapsed))
+    print("Max difference: {:.2e}".format(np.max(np.abs(
+        qaoa.simulate(native) - qaoa.simulate(with_cz)))))
+
+
+def benchmark_symbolic_circuit(ngamma=20, nbeta=20):
+    """Compares rebuilding the circuit at every point with sweeping one
+    symbolic circuit."""
+    gammavals = np.linspace(0, 1.0, ngamma)
+    betavals = np.linspace(0, np.pi, nbeta)
+
+    start = time.perf_counter()
+    expected = np.array([[qaoa.energy_from_wavefunction(
+        qaoa.simulate(qaoa.qaoa([gamma], [beta])))
+        for beta in betavals] for gamma in gammavals])
+    rebuild_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    costmat = qaoa.grid_search_cirq(gammavals, betavals)
+    sweep_time = time.perf_counter() - start
+
+    print("Cirq landscape of {} x {} points".format(ngamma, nbeta))
+    print("Rebuilt circuits: {:.3f} s".format(rebuild_time))
+    print("Symbolic sweep:   {:.3f} s".format(sweep_time))
+    print("Max difference: {:.2e}".format(np.max(np.abs(costmat - expected))))
+
+
+def benchmark_sampler(gamma=0.3, beta=0.7, nreps=10000):
+    """Compares sampling with the Cirq simulator with sampling from the
+    wavefunction."""
+    start = time.perf_counter()
+    cirq_hist = qaoa.get_bit_strings([gamma], [beta], nreps).histogram(key="m")
+    cirq_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    hist = qaoa.sample_bit_strings([gamma], [beta], nreps)
+    direct_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    qaoa.sample_bit_strings([gamma], [beta], 10 ** 7)
+    large_time = time.perf_counter() - start
+
+    nsites = qaoa.grid_problem.nsites
+    distance = sum(abs(hist[k] - cirq_hist[k])
+                   for k in range(2 ** nsites)) / (2 * nreps)
+    print("{} samples".format(nreps))
+    print("Cirq run:    {:.3f} s".format(cirq_time))
+    print("Direct:      {:.3f} s".format(direct_time))
+    print("10^7 direct: {:.3f} s".format(large_time))
+    print("Total variation distance: {:.3f}".format(distance))
+
+
+def benchmark_mps(nrows=6, ncols=6, gammas=(0.1, 0.2), betas=(0.2, 0.1),
+                  bonds=(16, 32, 64, 128)):
+    """Compares the matrix product state energy at several bond dimensions
+    with the light cone energy on a grid too large for a wavefunction."""
+    problem = qaoa.IsingProblem.grid(nrows, ncols)
+    circuit = qaoa.qaoa(gammas, betas, problem)
+    exact = qaoa.light_cone_energy(gammas, betas, problem)
+
+    print("QAOA for p = {} on a {} x {} grid".format(len(gammas), nrows,
+                                                    ncols))
+    print("Light cone energy: {:.6f}".format(exact))
+    for bond in bonds:
+        start = time.perf_counter()
+        mps = qaoa.simulate_mps(circuit, problem, max_bond=bond)
+        energy = mps.energy(problem)
+        elapsed = time.perf_counter() - start
+        print("Bond {:>4}: {:.6f}, truncation error {:.2e}, {:.3f} s".format(
+            bond, energy, mps.truncation_error, elapsed))
+
+
+if __name__ == "__main__":
+    benchmark_landscape()
+    print()
+    benchmark_cost_layer()
+    print()
+    benchmark_symbolic_circuit()
+    print()
+    benchmark_sampler()
+    print()
+    benchmark_mps()
@@ -1,19 +1,44 @@
 """Example using QAOA to solve MaxCut from Chapter 9.3.
 
 Requirements:
+python>=3.8
 cirq==0.7.0
+scipy
+sympy
 """
 
 # Imports
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import tempfile
+from multiprocessing import shared_memory
+
 import numpy as np
 import matplotlib.pyplot as plt
+import sympy
+from scipy.optimize import minimize
 
 import cirq
 
 
 # Function to implement a ZZ gate on qubits a, b with angle gamma
 def ZZ(a, b, gamma):
-    """Returns a circuit implementing exp(-i \pi \gamma Z_i Z_j)."""
+    r"""Returns a circuit implementing exp(i \pi \gamma Z_i Z_j).
+
+    This is a single ZZPowGate. The global shift makes it equal to ZZ_cz,
+    not only up to a global phase.
+    """
+    return cirq.Circuit(
+        cirq.ZZPowGate(exponent=-2 * gamma, global_shift=-0.5)(a, b))
+
+
+# The same gate built from controlled-Z gates
+def ZZ_cz(a, b, gamma):
+    r"""Returns a circuit implementing exp(i \pi \gamma Z_i Z_j) with four
+    CZ**gamma gates and eight X gates."""
     # Get a circuit
     circuit = cirq.Circuit()
 
@@ -33,120 +58,922 @@ def ZZ(a, b, gamma):
     return circuit
 
 
-# 26.s.one
-# Make sure the circuit gives the correct matrix
-qreg = cirq.LineQubit.range(2)
-zzcirc = ZZ(qreg[0], qreg[1], 0.5)
-print("Circuit for ZZ gate:", zzcirc, sep="\n")
-print("\nUnitary of circuit:", zzcirc.unitary().round(2), sep="\n")
+class IsingProblem:
+    """An Ising cost function on an arbitrary weighted graph.
+
+    The energy per site of a configuration z of spins z_i = +1 or -1 is
+
+        E(z) = -(sum_(i,j) w_ij z_i z_j + sum_i h_i z_i) / nsites.
+
+    Spin i is stored in qubit i, and a spin is -1 when its qubit is 1.
+    """
+
+    def __init__(self, nsites, edges, fields=None, qubits=None):
+        """Initializes the problem.
+
+        Args:
+            nsites: Number of spins.
+            edges: List of (i, j) or (i, j, w) couplings. The weight w
+                defaults to 1.
+            fields: Local fields h_i, one per site. Defaults to zero.
+            qubits: Qubits for the sites. Defaults to line qubits.
+        """
+        self.nsites = nsites
+        self.edges = tuple((e[0], e[1], e[2] if len(e) > 2 else 1.0)
+                           for e in edges)
+        self.fields = tuple(np.zeros(nsites) if fields is None
+                            else np.ravel(fields))
+        self.qubits = (cirq.LineQubit.range(nsites) if qubits is None
+                       else list(qubits))
+
+    @classmethod
+    def grid(cls, nrows, ncols, h=None):
+        """Returns the nearest-neighbor model on a grid of qubits, with the
+        fields h given as an array of shape (nrows, ncols)."""
+        edges = []
+        for i in range(nrows):
+            for j in range(ncols):
+                if i < nrows - 1:
+                    edges.append((i * ncols + j, (i + 1) * ncols + j))
+                if j < ncols - 1:
+                    edges.append((i * ncols + j, i * ncols + (j + 1)))
+        qubits = [cirq.GridQubit(i, j)
+                  for i in range(nrows) for j in range(ncols)]
+        return cls(nrows * ncols, edges, h, qubits)
+
+    @classmethod
+    def maxcut(cls, nsites, edges):
+        """Returns the problem whose ground states are the maximum cuts of a
+        graph: each (i, j, w) edge becomes a coupling of weight -w."""
+        edges = [(e[0], e[1], -(e[2] if len(e) > 2 else 1.0)) for e in edges]
+        return cls(nsites, edges)
+
+    def _key(self):
+        return (self.nsites, self.edges, self.fields)
+
+    @staticmethod
+    def _canonical(x):
+        # Ints, floats and numpy scalars of equal value, and -0.0 and 0.0,
+        # give the same string on any numpy version.
+        return '%.9g' % (float(x) + 0.0)
+
+    def digest(self):
+        """Returns a hex string which is the same exactly for identical
+        problems: the same sites, edges and fields, with the edges in any
+        order and direction. Weights and fields are compared to 9
+        significant digits, whatever their type."""
+        edges = sorted((min(i, j), max(i, j), self._canonical(w))
+                       for i, j, w in self.edges)
+        fields = [self._canonical(h) for h in self.fields]
+        return hashlib.sha1(repr((self.nsites, edges, fields)).encode()
+                            ).hexdigest()[:16]
+
+    def fingerprint(self, rounds=3):
+        """Returns a hex string which is the same for isomorphic problems.
+
+        Sites are colored by their field and refined rounds times by the
+        multiset of (weight, neighbor color) pairs. The fingerprint hashes
+        the final multiset of colors, so relabeling the sites never changes
+        it, but problems which are not isomorphic can share it: color
+        refinement does not tell apart regular graphs with the same size,
+        degree and weights. Weights and fields are compared to 9 significant
+        digits, whatever their type.
+        """
+        neighbors = [[] for _ in range(self.nsites)]
+        for i, j, w in self.edges:
+            neighbors[i].append((j, self._canonical(w)))
+            neighbors[j].append((i, self._canonical(w)))
+        colors = [self._canonical(h) for h in self.fields]
+        for _ in range(rounds):
+            colors = [hashlib.sha1(repr((colors[k], sorted(
+                (w, colors[l]) for l, w in neighbors[k]))).encode()).hexdigest()
+                for k in range(self.nsites)]
+        return hashlib.sha1(repr(sorted(colors)).encode()).hexdigest()[:16]
+
+    def features(self):
+        """Returns a vector of graph statistics which is close for similar
+        problems: log2 of the number of sites, the mean and standard
+        deviation of the degrees and of the weights, and the mean absolute
+        field."""
+        degrees = np.zeros(self.nsites)
+        for i, j, _ in self.edges:
+            degrees[i] += 1
+            degrees[j] += 1
+        weights = np.array([w for _, _, w in self.edges] or [0.0])
+        return np.array([np.log2(self.nsites), degrees.mean(), degrees.std(),
+                         weights.mean(), weights.std(),
+                         np.mean(np.abs(self.fields))])
+
+    def spins(self, basis_states):
+        """Returns the spins of each basis state, of shape (..., nsites)."""
+        shifts = np.arange(self.nsites - 1, -1, -1)
+        bits = (np.asarray(basis_states)[..., None] >> shifts) & 1
+        return 1 - 2 * bits
+
+    def diagonal(self):
+        """Returns the energy per site of every computational basis state, in
+        the order of the wavefunction. The result is cached."""
+        key = self._key()
+        if key in _diagonal_cache:
+            _diagonal_cache.move_to_end(key)
+            return _diagonal_cache[key]
+
+        # Each z_i z_j is +1 or -1 according to the parity of bits i and j.
+        n = self.nsites
+        states = np.arange(2 ** n)
+        diagonal = np.zeros(2 ** n)
+        for i, j, w in self.edges:
+            parity = ((states >> (n - 1 - i)) ^ (states >> (n - 1 - j))) & 1
+            diagonal -= w * (1 - 2 * parity)
+        for i, h in enumerate(self.fields):
+            if h:
+                diagonal -= h * (1 - 2 * ((states >> (n - 1 - i)) & 1))
+        diagonal /= n
+
+        _cache_diagonal(key, diagonal)
+        return diagonal
+
+    def energy(self, wf):
+        """Returns the expected energy per site of a wavefunction, or of each
+        row of a batch of wavefunctions."""
+        return np.abs(wf) ** 2 @ self.diagonal()
+
+
+# Cost diagonals of IsingProblems, least recently used first. Their total
+# size is kept below DIAGONAL_CACHE_BYTES.
+DIAGONAL_CACHE_BYTES = 2 ** 28
+_diagonal_cache = collections.OrderedDict()
+
+
+def _cache_diagonal(key, diagonal):
+    """Caches a diagonal, evicting the least recently used ones to make
+    room."""
+    if diagonal.nbytes > DIAGONAL_CACHE_BYTES:
+        return
+    _diagonal_cache[key] = diagonal
+    while sum(d.nbytes for d in _diagonal_cache.values()) > DIAGONAL_CACHE_BYTES:
+        _diagonal_cache.popitem(last=False)
+
 
 ncols = 2
 nrows = 2
 qreg = [[cirq.GridQubit(i,j) for j in range(ncols)] for i in range(nrows)]
 
+# Nearest-neighbor Ising model on the grid, used unless another problem is
+# given
+grid_problem = IsingProblem.grid(nrows, ncols)
+
 # Function to implement the cost Hamiltonian
-def cost_circuit(gamma):
-    """Returns a circuit for the cost Hamiltonian."""
+def cost_circuit(gamma, problem=grid_problem):
+    """Returns a circuit for the cost Hamiltonian, exp(-i pi gamma H) for
+    H = nsites * E."""
     circ = cirq.Circuit()
-    for i in range(nrows):
-        for j in range(ncols):
-            if i < nrows - 1:
-                circ += ZZ(qreg[i][j], qreg[i + 1][j], gamma)
-            if j < ncols - 1:
-                circ += ZZ(qreg[i][j], qreg[i][j + 1], gamma)
+    q = problem.qubits
+    for i, j, w in problem.edges:
+        circ += ZZ(q[i], q[j], gamma * w)
+    for i, h in enumerate(problem.fields):
+        if h:
+            circ.append(cirq.ZPowGate(exponent=-2 * gamma * h,
+                                      global_shift=-0.5)(q[i]))
 
     return circ
 
 # Function to implement the mixer Hamiltonian
-def mixer(beta):
+def mixer(beta, problem=grid_problem):
   """Generator for U(H_B, beta) layer (mixing layer)"""
-  for row in qreg:
-    for qubit in row:
-      yield cirq.X(qubit)**beta
+  for qubit in problem.qubits:
+    yield cirq.X(qubit)**beta
 
 
 # Function to build the QAOA circuit
-def qaoa(gammas, betas):
+def qaoa(gammas, betas, problem=grid_problem):
     """Returns a QAOA circuit."""
     circ = cirq.Circuit()
-    circ.append(cirq.H.on_each(*[q for row in qreg for q in row]))
+    circ.append(cirq.H.on_each(*problem.qubits))
 
     for i in range(len(gammas)):
-        circ += cost_circuit(gammas[i])
-        circ.append(mixer(betas[i]))
+        circ += cost_circuit(gammas[i], problem)
+        circ.append(mixer(betas[i], problem))
 
     return circ
 
-def simulate(circ):
+# Symbolic QAOA circuits keyed by problem, qubits and depth
+_circuit_cache = {}
+
+
+def symbolic_qaoa(p, problem=grid_problem):
+    """Returns a depth-p QAOA circuit whose angles are the sympy symbols
+    gamma_0, ..., gamma_{p-1} and beta_0, ..., beta_{p-1}.
+
+    The circuit is built once per problem and depth, and evaluated at
+    different angles through resolvers from qaoa_resolver."""
+    key = (problem._key(), tuple(problem.qubits), p)
+    if key not in _circuit_cache:
+        gammas = sympy.symbols("gamma_:{}".format(p))
+        betas = sympy.symbols("beta_:{}".format(p))
+        _circuit_cache[key] = qaoa(gammas, betas, problem)
+    return _circuit_cache[key]
+
+
+def qaoa_resolver(gammas, betas):
+    """Returns the resolver giving the angles of a symbolic_qaoa circuit."""
+    params = {"gamma_{}".format(i): gamma for i, gamma in enumerate(gammas)}
+    params.update({"beta_{}".format(i): beta for i, beta in enumerate(betas)})
+    return cirq.ParamResolver(params)
+
+
+def simulate(circ, problem=grid_problem):
     """Returns the wavefunction after applying the circuit."""
     sim = cirq.Simulator()
-    return sim.simulate(circ).final_state_vector
-
-
-def energy_from_wavefunction(wf):
-    """Computes the energy-per-site of the Ising Model from the wavefunction."""
-    # Z is a (n_sites x 2**n_sites) array. Each row consists of the
-    # 2**n_sites non-zero entries in the operator that is the Pauli-Z matrix on
-    # one of the qubits times the identites on the other qubits. The (i*n_cols + j)th
-    # row corresponds to qubit (i,j).
-    nsites = nrows * ncols
-    Z = np.array([(-1) ** (np.arange(2 ** nsites) >> i)
-                  for i in range(nsites - 1, -1, -1)])
-
-    # Create the operator corresponding to the interaction energy summed over all
-    # nearest-neighbor pairs of qubits
-    ZZ_filter = np.zeros_like(wf, dtype=float)
-    for i in range(nrows):
-        for j in range(ncols):
-            if i < nrows - 1:
-                ZZ_filter += Z[i * ncols + j] * Z[(i + 1) * ncols + j]
-            if j < ncols - 1:
-                ZZ_filter += Z[i * ncols + j] * Z[i * ncols + (j + 1)]
-
-    # Expectation value of the energy divided by the number of sites
-    return -np.sum(np.abs(wf) ** 2 * ZZ_filter) / nsites
-
-def cost(gammas, betas):
+    return sim.simulate(circ, qubit_order=problem.qubits).final_state_vector
+
+
+def energy_from_wavefunction(wf, problem=grid_problem):
+    """Computes the energy-per-site of the Ising Model from the wavefunction.
+
+    This is a single dot product of |wf|^2 with the cached cost diagonal of
+    the problem."""
+    return problem.energy(wf)
+
+def cost(gammas, betas, problem=grid_problem):
     """Returns the cost function of the problem."""
-    wavefunction = simulate(qaoa(gammas, betas))
-    return energy_from_wavefunction(wavefunction)
+    sim = cirq.Simulator()
+    result = sim.simulate(symbolic_qaoa(len(gammas), problem),
+                          qaoa_resolver(gammas, betas),
+                          qubit_order=problem.qubits)
+    return energy_from_wavefunction(result.final_state_vector, problem)
+
+
+def apply_mixer(states, betas):
+    """Applies the mixing layer to a batch of wavefunctions.
+
+    states has shape (batch, 2**nsites) and betas has shape (batch,). Up to
+    a global phase, X**beta is the rotation cos(pi beta/2) - i sin(pi beta/2) X,
+    which is applied to one qubit axis at a time.
+    """
+    nsites = int(np.log2(states.shape[1]))
+    c = np.cos(np.pi * betas / 2)[:, None, None, None]
+    s = np.sin(np.pi * betas / 2)[:, None, None, None]
+    for k in range(nsites):
+        states = states.reshape(len(betas), 2 ** k, 2, -1)
+        states = c * states - 1j * s * states[:, :, ::-1, :]
+    return states.reshape(len(betas), -1)
+
+
+def landscape(gammavals, betavals, problem=grid_problem, max_states=2 ** 22):
+    """Returns the cost at every (gamma, beta) pair of a p = 1 grid.
+
+    The cost layer is diagonal, so its phases are computed once from the
+    cost diagonal and the whole grid is evaluated with batched NumPy
+    operations, at most max_states wavefunction entries at a time.
+    The result is the same as cost([gamma], [beta]) at each point.
+    """
+    nsites = problem.nsites
+    diagonal = problem.diagonal()
+    gammas, betas = np.meshgrid(gammavals, betavals, indexing="ij")
+    gammas, betas = gammas.ravel(), betas.ravel()
+    chunk = max(1, max_states // 2 ** nsites)
+
+    costs = np.empty(len(gammas))
+    for start in range(0, len(gammas), chunk):
+        g = gammas[start:start + chunk]
+        b = betas[start:start + chunk]
+        # The cost layer applies exp(-i pi gamma nsites E) to |+...+>.
+        states = (np.exp(-1j * np.pi * nsites * g[:, None] * diagonal)
+                  / 2 ** (nsites / 2))
+        states = apply_mixer(states, b)
+        costs[start:start + chunk] = problem.energy(states)
 
+    return costs.reshape(len(gammavals), len(betavals))
 
-def grid_search(gammavals, betavals):
+
+def grid_search(gammavals, betavals, problem=grid_problem):
     """Does a grid search over all parameter values."""
+    return landscape(gammavals, betavals, problem)
+
+
+def grid_search_cirq(gammavals, betavals, problem=grid_problem):
+    """Does a grid search by simulating the Cirq circuit at every point.
+
+    The symbolic circuit is built once and swept over all the points, one
+    row of gammas at a time."""
     costmat = np.zeros((len(gammavals), len(betavals)))
+    circ = symbolic_qaoa(1, problem)
+    sim = cirq.Simulator()
 
     for (i, gamma) in enumerate(gammavals):
-        for (j, beta) in enumerate(betavals):
-            costmat[i, j] = cost([gamma], [beta])
+        resolvers = [qaoa_resolver([gamma], [beta]) for beta in betavals]
+        results = sim.simulate_sweep(circ, resolvers,
+                                     qubit_order=problem.qubits)
+        for (j, result) in enumerate(results):
+            costmat[i, j] = energy_from_wavefunction(
+                result.final_state_vector, problem)
 
     return costmat
 
-# Get a range of parameters
-gammavals = np.linspace(0, 1.0, 50)
-betavals = np.linspace(0, np.pi, 75)
 
-# Compute the cost at all parameter values using a grid search
-costmat = grid_search(gammavals, betavals)
+def _fill_tile(shm_name, shape, gammavals, betavals, problem, tile):
+    """Computes the missing (NaN) costs of one tile of the landscape and
+    writes them straight into the shared cost matrix."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        costmat = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        rows, cols = tile
+        circ = symbolic_qaoa(1, problem)
+        sim = cirq.Simulator()
+        for i in range(*rows):
+            missing = [j for j in range(*cols) if np.isnan(costmat[i, j])]
+            resolvers = [qaoa_resolver([gammavals[i]], [betavals[j]])
+                         for j in missing]
+            results = sim.simulate_sweep(circ, resolvers,
+                                         qubit_order=problem.qubits)
+            for j, result in zip(missing, results):
+                costmat[i, j] = energy_from_wavefunction(
+                    result.final_state_vector, problem)
+    finally:
+        shm.close()
+
+
+def parallel_grid_search(gammavals, betavals, problem=grid_problem,
+                         costmat=None, tile_shape=(10, 15), max_workers=None,
+                         progress=True):
+    """Does grid_search_cirq over a process pool.
+
+    The grid is split into tiles, each simulated by one worker, and the
+    workers write into a cost matrix in shared memory rather than sending
+    results back. Entries which are NaN are missing: passing a partially
+    filled costmat resumes a scan, and if the scan is interrupted with
+    Ctrl-C the partially filled matrix is returned.
+
+    Args:
+        gammavals: Values of gamma.
+        betavals: Values of beta.
+        problem: The IsingProblem to solve.
+        costmat: A partially filled cost matrix to resume from.
+        tile_shape: Number of gammas and betas in each tile.
+        max_workers: Size of the process pool.
+        progress: Whether to print the progress.
+
+    Returns:
+        The cost matrix.
+    """
+    shape = (len(gammavals), len(betavals))
+    shm = shared_memory.SharedMemory(create=True,
+                                     size=int(np.prod(shape)) * 8)
+    try:
+        shared = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        shared[:] = np.nan if costmat is None else costmat
+
+        tiles = []
+        for i in range(0, shape[0], tile_shape[0]):
+            for j in range(0, shape[1], tile_shape[1]):
+                rows = (i, min(i + tile_shape[0], shape[0]))
+                cols = (j, min(j + tile_shape[1], shape[1]))
+                if np.isnan(shared[slice(*rows), slice(*cols)]).any():
+                    tiles.append((rows, cols))
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            futures = [executor.submit(_fill_tile, shm.name, shape,
+                                       gammavals, betavals, problem, tile)
+                       for tile in tiles]
+            try:
+                for done, future in enumerate(
+                        concurrent.futures.as_completed(futures), 1):
+                    future.result()
+                    if progress:
+                        print("\rTiles done: {}/{}".format(done, len(tiles)),
+                              end="", flush=True)
+            except KeyboardInterrupt:
+                for future in futures:
+                    future.cancel()
+            if progress:
+                print()
+
+        return shared.copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def qaoa_state(gammas, betas, problem=grid_problem):
+    """Returns the wavefunction of a depth-p QAOA circuit, simulated with
+    NumPy. It equals simulate(qaoa(gammas, betas)) up to a global phase."""
+    nsites = problem.nsites
+    phases = -np.pi * nsites * problem.diagonal()
+    state = np.full(2 ** nsites, 2 ** (-nsites / 2), dtype=complex)
+    for gamma, beta in zip(gammas, betas):
+        state = state * np.exp(1j * gamma * phases)
+        state = apply_mixer(state[None], np.array([beta]))[0]
+    return state
+
+
+def _apply_x_sum(states):
+    """Returns the sum over qubits of X_k applied to a batch of
+    wavefunctions."""
+    nsites = int(np.log2(states.shape[1]))
+    total = np.zeros_like(states)
+    for k in range(nsites):
+        flipped = states.reshape(len(states), 2 ** k, 2, -1)[:, :, ::-1, :]
+        total += flipped.reshape(states.shape)
+    return total
+
+
+def energy_and_gradient(params, problem=grid_problem):
+    """Returns the energy of a depth-p QAOA and its exact gradient.
+
+    params holds gamma_1, ..., gamma_p followed by beta_1, ..., beta_p.
+    The gradient of all 2p parameters is computed by adjoint
+    differentiation: one forward simulation, then one backward pass which
+    undoes each layer on the state and on H|psi>. A layer exp(-i theta G)
+    contributes 2 Re <lambda| -i G |psi> to the derivative in theta.
+    This can be passed to scipy.optimize.minimize with jac=True.
+    """
+    params = np.asarray(params, dtype=float)
+    p = len(params) // 2
+    gammas, betas = params[:p], params[p:]
+    diagonal = problem.diagonal()
+    # The cost layer is exp(-i gamma G) with G = pi nsites E, and the mixer
+    # is exp(-i beta (pi / 2) sum_k X_k) up to a global phase.
+    cost_generator = np.pi * problem.nsites * diagonal
+
+    state = qaoa_state(gammas, betas, problem)
+    energy = np.real(np.vdot(state, diagonal * state))
+
+    grad = np.empty(2 * p)
+    pair = np.stack([state, diagonal * state])
+    for layer in reversed(range(p)):
+        state, adjoint = pair
+        grad[p + layer] = 2 * np.real(np.vdot(
+            adjoint, -1j * np.pi / 2 * _apply_x_sum(state[None])[0]))
+        pair = apply_mixer(pair, np.full(2, -betas[layer]))
+
+        state, adjoint = pair
+        grad[layer] = 2 * np.real(np.vdot(
+            adjoint, -1j * cost_generator * state))
+        pair = pair * np.exp(1j * gammas[layer] * cost_generator)
+
+    return energy, grad
+
+
+def optimize_qaoa(p, problem=grid_problem, initial=None, method="BFGS",
+                  **kwargs):
+    """Minimizes the energy of a depth-p QAOA with exact gradients.
+
+    Args:
+        p: Number of QAOA layers.
+        problem: The IsingProblem to solve.
+        initial: Starting (gamma_1, ..., gamma_p, beta_1, ..., beta_p).
+            Defaults to a linear ramp from the mixer to the cost layer.
+        method: A scipy.optimize.minimize method which uses gradients.
+        kwargs: Further arguments for scipy.optimize.minimize.
 
-# Plot the cost landscape
-plt.imshow(costmat, extent=(0, 1, 0, np.pi), origin="lower", aspect="auto")
-plt.colorbar()
-plt.show()
+    Returns:
+        The scipy.optimize.OptimizeResult. Its x holds the optimal gammas
+        followed by the optimal betas.
+    """
+    if initial is None:
+        ramp = (np.arange(p) + 0.5) / p
+        initial = np.concatenate([0.1 * ramp, 0.1 * ramp[::-1]])
+    return minimize(energy_and_gradient, initial, args=(problem,), jac=True,
+                    method=method, **kwargs)
 
-# Coordinates from the grid of cost values
-gamma_coord, beta_coord = np.where(costmat == np.min(costmat))
 
-# Values from the coordinates
-gamma_opt = gammavals[gamma_coord[0]]
-beta_opt = betavals[beta_coord[0]]
+def interp_params(params):
+    """Returns starting parameters for depth p + 1 from optimal parameters
+    for depth p by linear interpolation (the INTERP strategy).
 
+    The gammas and betas of depth p are read as samples of smooth schedules
+    and resampled at p + 1 points:
 
-def get_bit_strings(gammas, betas, nreps=10000):
+        x'_i = (i - 1) / p * x_(i-1) + (p - i + 1) / p * x_i,
+
+    for i = 1, ..., p + 1, with x_0 = x_(p+1) = 0.
+    """
+    gammas, betas = np.split(np.asarray(params, dtype=float), 2)
+    p = len(gammas)
+    i = np.arange(1, p + 2)
+
+    def resample(x):
+        padded = np.concatenate([[0.0], x, [0.0]])
+        return (i - 1) / p * padded[i - 1] + (p - i + 1) / p * padded[i]
+
+    return np.concatenate([resample(gammas), resample(betas)])
+
+
+def _fourier_basis(p, q):
+    # Rows are layers i, columns are frequencies k, both counted from 1/2.
+    phase = np.outer(np.arange(p) + 0.5, np.arange(q) + 0.5) * np.pi / p
+    return np.sin(phase), np.cos(phase)
+
+
+def fourier_params(params):
+    """Returns starting parameters for depth p + 1 from optimal parameters
+    for depth p through their Fourier components (the FOURIER strategy).
+
+    The schedules are written as
+
+        gamma_i = sum_k u_k sin((k - 1/2) (i - 1/2) pi / p),
+        beta_i = sum_k v_k cos((k - 1/2) (i - 1/2) pi / p),
+
+    with p components u and v, which are then evaluated at p + 1 layers.
+    """
+    gammas, betas = np.split(np.asarray(params, dtype=float), 2)
+    p = len(gammas)
+    sin_basis, cos_basis = _fourier_basis(p, p)
+    u = np.linalg.solve(sin_basis, gammas)
+    v = np.linalg.solve(cos_basis, betas)
+    sin_basis, cos_basis = _fourier_basis(p + 1, p)
+    return np.concatenate([sin_basis @ u, cos_basis @ v])
+
+
+class ParameterStore:
+    """Optimized QAOA parameters saved in a JSON file.
+
+    Entries are keyed by IsingProblem.digest() and the depth p, so get()
+    only finds parameters of the very same problem, and put() only
+    compares energies of the same problem. Other problems are matched by
+    nearest() to a stored one with the same IsingProblem.fingerprint(),
+    such as a relabeling of theirs, or else with the closest
+    IsingProblem.features(). Since energies are per site, parameters for
+    similar graphs are good starting points for each other.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def get(self, problem, p):
+        """Returns the stored parameters of the problem at depth p, or None."""
+        entry = self.entries.get(problem.digest(), {})
+        if str(p) in entry.get("params", {}):
+            return np.array(entry["params"][str(p)]["x"])
+        return None
+
+    def nearest(self, problem, p, max_distance=1.0):
+        """Returns the stored parameters at depth p of a problem with the
+        same fingerprint, or else of the problem with the closest features,
+        or None if none is within max_distance."""
+        fingerprint = problem.fingerprint()
+        features = problem.features()
+        best, best_distance = None, max_distance
+        for entry in self.entries.values():
+            if str(p) not in entry["params"]:
+                continue
+            if entry.get("fingerprint") == fingerprint:
+                return np.array(entry["params"][str(p)]["x"])
+            distance = np.linalg.norm(features - entry["features"])
+            if distance <= best_distance:
+                best = np.array(entry["params"][str(p)]["x"])
+                best_distance = distance
+        return best
+
+    def put(self, problem, p, params, energy):
+        """Stores parameters unless better ones for the problem are already
+        stored, and writes the file."""
+        entry = self.entries.setdefault(problem.digest(), {
+            "fingerprint": problem.fingerprint(),
+            "features": problem.features().tolist(), "params": {}})
+        old = entry["params"].get(str(p))
+        if old is not None and old["energy"] <= energy:
+            return
+        entry["params"][str(p)] = {"x": np.asarray(params).tolist(),
+                                   "energy": float(energy)}
+        # Write a temporary file first so a crash never leaves half a store.
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.entries, f)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def optimize_qaoa_stored(p, problem=grid_problem, store=None,
+                         strategy=interp_params, **kwargs):
+    """Optimizes a depth-p QAOA starting from the best known parameters.
+
+    The starting point is, in order of preference, the stored parameters
+    of the problem at depth p, those of the nearest stored problem at depth
+    p, or strategy (interp_params or fourier_params) applied to the result
+    of this function at depth p - 1. At p = 1 without stored parameters the
+    best point of a coarse landscape() scan over gamma in [0, 1] and beta
+    in [0, pi] is used. Every result is put in the store.
+
+    Args:
+        p: Number of QAOA layers.
+        problem: The IsingProblem to solve.
+        store: A ParameterStore. Without one nothing is remembered, but the
+            levels below p still warm start each other.
+        strategy: Function from parameters at depth p - 1 to depth p.
+        kwargs: Further arguments for optimize_qaoa.
+
+    Returns:
+        The scipy.optimize.OptimizeResult of depth p. Its nfev counts the
+        optimizer evaluations at every depth optimized by this call, but not
+        the coarse scan.
+    """
+    initial = None
+    if store is not None:
+        initial = store.get(problem, p)
+        if initial is None:
+            initial = store.nearest(problem, p)
+    nfev = 0
+    if initial is None and p > 1:
+        lower = optimize_qaoa_stored(p - 1, problem, store, strategy,
+                                     **kwargs)
+        initial = strategy(lower.x)
+        nfev = lower.nfev
+    elif initial is None:
+        gammavals = np.linspace(0, 1.0, 20)
+        betavals = np.linspace(0, np.pi, 20)
+        costmat = landscape(gammavals, betavals, problem)
+        gamma_coord, beta_coord = np.unravel_index(np.argmin(costmat),
+                                                   costmat.shape)
+        initial = np.array([gammavals[gamma_coord], betavals[beta_coord]])
+    result = optimize_qaoa(p, problem, initial, **kwargs)
+    result.nfev += nfev
+    if store is not None:
+        store.put(problem, p, result.x, result.fun)
+    return result
+
+
+def _light_cone(problem, neighbors, marked, p):
+    """Returns the sub-problem which determines the expectation of the
+    product of Z on the marked sites after p QAOA layers, together with the
+    positions of the marked sites in it and a key identifying it.
+
+    The sub-problem is induced by the sites within distance p of the marked
+    ones. Its sites are ordered by distance and then by color refinement, so
+    isomorphic light cones usually get the same key. Equal keys always mean
+    identical sub-problems, so a cache on the key is exact.
+    """
+    distance = {site: 0 for site in marked}
+    frontier = list(marked)
+    for d in range(1, p + 1):
+        frontier = [k for site in frontier for k in neighbors[site]
+                    if k not in distance]
+        for k in frontier:
+            distance[k] = d
+    sites = list(distance)
+
+    # Refine colors by the multiset of (weight, neighbor color) pairs.
+    colors = {k: (distance[k], problem.fields[k]) for k in sites}
+    for _ in range(p + 1):
+        colors = {k: (colors[k], tuple(sorted(
+            (w, colors[l]) for l, w in neighbors[k].items() if l in colors)))
+            for k in sites}
+    sites.sort(key=lambda k: (distance[k], colors[k], k))
+    index = {k: n for n, k in enumerate(sites)}
+
+    edges = sorted(tuple(sorted((index[i], index[j]))) + (w,)
+                   for i, j, w in problem.edges if i in index and j in index)
+    fields = [problem.fields[k] for k in sites]
+    positions = tuple(sorted(index[k] for k in marked))
+    sub = IsingProblem(len(sites), edges, fields)
+    return sub, positions, (sub._key(), positions)
+
+
+def light_cone_energy(gammas, betas, problem=grid_problem, max_qubits=20):
+    """Returns the energy per site of a depth-p QAOA without simulating the
+    whole wavefunction.
+
+    After p layers, <Z_i Z_j> only depends on the sites within distance p
+    of i and j, and <Z_i> on those within distance p of i. Each term is
+    computed by simulating only that light cone, and terms whose light cones
+    are the same up to relabeling are simulated once. The memory needed is
+    set by the largest light cone, not by the size of the graph.
+    """
+    p = len(gammas)
+    neighbors = [dict() for _ in range(problem.nsites)]
+    for i, j, w in problem.edges:
+        neighbors[i][j] = neighbors[i].get(j, 0) + w
+        neighbors[j][i] = neighbors[j].get(i, 0) + w
+
+    expectations = {}
+
+    def expectation(marked):
+        sub, positions, key = _light_cone(problem, neighbors, marked, p)
+        if key not in expectations:
+            if sub.nsites > max_qubits:
+                raise ValueError("A light cone has {} qubits, more than "
+                                 "max_qubits = {}.".format(sub.nsites,
+                                                           max_qubits))
+            probs = np.abs(qaoa_state(gammas, betas, sub)) ** 2
+            spins = sub.spins(np.arange(2 ** sub.nsites))[:, positions]
+            expectations[key] = probs @ np.prod(spins, axis=1)
+        return expectations[key]
+
+    total = sum(w * expectation((i, j)) for i, j, w in problem.edges)
+    total += sum(h * expectation((i,))
+                 for i, h in enumerate(problem.fields) if h)
+    return -total / problem.nsites
+
+
+class MPS:
+    """A matrix product state of qubits with a capped bond dimension.
+
+    Site k holds a tensor of shape (left bond, 2, right bond). Diagonal
+    two-qubit gates, such as the ZZ gates of the cost layer, are applied to
+    sites which are not neighbors in the chain as a bond dimension 2
+    operator spanning the sites in between. Other gates on distant sites
+    are applied by swapping the sites next to each other and back. After
+    every two-qubit gate the bonds are truncated to max_bond singular
+    values, dropping those below cutoff, and the discarded weight is added
+    to truncation_error.
+    """
+
+    def __init__(self, nsites, max_bond=64, cutoff=1e-12):
+        self.tensors = [np.full((1, 2, 1), 2 ** -0.5, dtype=complex)
+                        for _ in range(nsites)]
+        self.max_bond = max_bond
+        self.cutoff = cutoff
+        # The tensors left of the center are left-canonical and the tensors
+        # right of it are right-canonical.
+        self.center = 0
+        self.truncation_error = 0.0
+
+    def _move_center(self, site):
+        while self.center < site:
+            k = self.center
+            left, _, right = self.tensors[k].shape
+            q, r = np.linalg.qr(self.tensors[k].reshape(left * 2, right))
+            self.tensors[k] = q.reshape(left, 2, -1)
+            self.tensors[k + 1] = np.tensordot(r, self.tensors[k + 1], 1)
+            self.center += 1
+        while self.center > site:
+            k = self.center
+            left, _, right = self.tensors[k].shape
+            q, r = np.linalg.qr(self.tensors[k].reshape(left, 2 * right).T)
+            self.tensors[k] = q.T.reshape(-1, 2, right)
+            self.tensors[k - 1] = np.tensordot(self.tensors[k - 1], r.T, 1)
+            self.center -= 1
+
+    def apply_one(self, site, U):
+        """Applies a 2 x 2 unitary to a site."""
+        self.tensors[site] = np.einsum("st,atb->asb", U, self.tensors[site])
+
+    def _truncated_svd(self, matrix):
+        u, svals, vh = np.linalg.svd(matrix, full_matrices=False)
+        weights = svals ** 2 / np.sum(svals ** 2)
+        bond = max(1, min(self.max_bond, np.sum(svals > self.cutoff)))
+        self.truncation_error += np.sum(weights[bond:])
+        svals = svals[:bond] / np.linalg.norm(svals[:bond])
+        return u[:, :bond], svals, vh[:bond]
+
+    def _apply_adjacent(self, site, U, center_left=False):
+        """Applies a 4 x 4 unitary to sites site and site + 1."""
+        if self.center not in (site, site + 1):
+            self._move_center(site)
+        left = self.tensors[site].shape[0]
+        right = self.tensors[site + 1].shape[2]
+        theta = np.einsum("asc,ctb->astb", self.tensors[site],
+                          self.tensors[site + 1])
+        theta = np.einsum("stuv,auvb->astb", U.reshape(2, 2, 2, 2), theta)
+        u, svals, vh = self._truncated_svd(theta.reshape(left * 2, 2 * right))
+        bond = len(svals)
+        if center_left:
+            u = u * svals
+        else:
+            vh = svals[:, None] * vh
+        self.tensors[site] = u.reshape(left, 2, bond)
+        self.tensors[site + 1] = vh.reshape(bond, 2, right)
+        self.center = site if center_left else site + 1
+
+    def _apply_diagonal(self, i, j, phases):
+        """Applies diag(phases), a 2 x 2 array indexed by the bits of sites
+        i < j, through a bond dimension 2 operator from site i to site j."""
+        self._move_center(i)
+        # The bit of site i is copied into a new bond index s which is
+        # carried along to site j, where it selects the phases.
+        tensor = self.tensors[i]
+        left, _, right = tensor.shape
+        new = np.zeros((left, 2, right, 2), dtype=complex)
+        new[:, 0, :, 0] = tensor[:, 0]
+        new[:, 1, :, 1] = tensor[:, 1]
+        self.tensors[i] = new.reshape(left, 2, 2 * right)
+        for k in range(i + 1, j):
+            tensor = self.tensors[k]
+            self.tensors[k] = np.einsum("apb,st->aspbt", tensor,
+                                        np.eye(2)).reshape(
+                2 * tensor.shape[0], 2, 2 * tensor.shape[2])
+        tensor = self.tensors[j]
+        self.tensors[j] = np.einsum("apb,sp->aspb", tensor, phases).reshape(
+            2 * tensor.shape[0], 2, tensor.shape[2])
+
+        # Sweep right with QR decompositions and back left with truncated
+        # SVDs, which leaves the center at site i again.
+        self._move_center(j)
+        for k in range(j, i, -1):
+            tensor = self.tensors[k]
+            left, _, right = tensor.shape
+            u, svals, vh = self._truncated_svd(tensor.reshape(left, 2 * right))
+            self.tensors[k] = vh.reshape(-1, 2, right)
+            self.tensors[k - 1] = np.tensordot(self.tensors[k - 1],
+                                               u * svals, 1)
+            self.center = k - 1
+
+    def apply_two(self, i, j, U):
+        """Applies a 4 x 4 unitary to sites i and j, in that order."""
+        if i > j:
+            i, j = j, i
+            U = U.reshape(2, 2, 2, 2).transpose(1, 0, 3, 2).reshape(4, 4)
+        if j > i + 1 and np.allclose(U, np.diag(np.diag(U))):
+            self._apply_diagonal(i, j, np.diag(U).reshape(2, 2))
+            return
+        swap = np.eye(4)[[0, 2, 1, 3]]
+        for k in range(j - 1, i, -1):
+            self._apply_adjacent(k, swap, center_left=True)
+        self._apply_adjacent(i, U)
+        for k in range(i + 1, j):
+            self._apply_adjacent(k, swap)
+
+    def expectation_z(self, sites):
+        """Returns the expectation of the product of Z on the sites."""
+        # Everything outside the sites contracts to the identity, because
+        # the tensors left of the center are left-canonical and those right
+        # of it right-canonical.
+        first, last = min(sites), max(sites)
+        self._move_center(first)
+        z = np.array([1, -1])
+        env = None
+        for k in range(first, last + 1):
+            tensor = self.tensors[k]
+            ket = tensor * z[None, :, None] if k in sites else tensor
+            if env is None:
+                env = np.tensordot(tensor.conj(), ket, ([0, 1], [0, 1]))
+            else:
+                env = np.tensordot(np.tensordot(env, tensor.conj(), (0, 0)),
+                                   ket, ([0, 1], [0, 1]))
+        return np.real(np.trace(env))
+
+    def energy(self, problem):
+        """Returns the energy per site of the state for an IsingProblem."""
+        total = sum(w * self.expectation_z((i, j))
+                    for i, j, w in problem.edges)
+        total += sum(h * self.expectation_z((i,))
+                     for i, h in enumerate(problem.fields) if h)
+        return -total / problem.nsites
+
+    def sample(self, nreps, seed=None):
+        """Samples bitstrings one site at a time.
+
+        Returns:
+            A collections.Counter as returned by sample_bit_strings.
+        """
+        rng = np.random.default_rng(seed)
+        self._move_center(0)
+        env = np.ones((nreps, 1), dtype=complex)
+        outcomes = np.zeros(nreps, dtype=np.int64)
+        for tensor in self.tensors:
+            # The sites to the right are right-canonical, so the norms of the
+            # two branches are the conditional probabilities of the bit.
+            branches = np.einsum("na,asb->nsb", env, tensor)
+            weights = np.sum(np.abs(branches) ** 2, axis=2)
+            bits = rng.random(nreps) * weights.sum(axis=1) < weights[:, 1]
+            env = branches[np.arange(nreps), bits.astype(int)]
+            env /= np.linalg.norm(env, axis=1, keepdims=True)
+            outcomes = 2 * outcomes + bits
+        return collections.Counter(outcomes.tolist())
+
+    def state_vector(self):
+        """Returns the full wavefunction, for checking small states."""
+        state = np.ones((1, 1))
+        for tensor in self.tensors:
+            state = np.tensordot(state, tensor, 1).reshape(-1, tensor.shape[2])
+        return state[:, 0]
+
+
+def simulate_mps(circ, problem=grid_problem, max_bond=64, cutoff=1e-12):
+    """Simulates a QAOA circuit as a matrix product state.
+
+    This plays the role of simulate() for grids too large for a
+    wavefunction. The sites are the qubits of the problem in order, and the
+    circuit must start from |0...0> with a layer of Hadamards, as qaoa()
+    circuits do; that layer is absorbed into the initial |+...+> state.
+
+    Returns:
+        The MPS, whose energy(problem), sample(nreps) and truncation_error
+        give the results.
+    """
+    index = {q: k for k, q in enumerate(problem.qubits)}
+    mps = MPS(problem.nsites, max_bond, cutoff)
+    ops = list(circ.all_operations())
+    hadamards = [op for op in ops[:problem.nsites] if op.gate == cirq.H]
+    if len(hadamards) != problem.nsites:
+        raise ValueError("The circuit must start with a Hadamard on every "
+                         "qubit.")
+    for op in ops[problem.nsites:]:
+        sites = [index[q] for q in op.qubits]
+        if len(sites) == 1:
+            mps.apply_one(sites[0], cirq.unitary(op))
+        else:
+            mps.apply_two(sites[0], sites[1], cirq.unitary(op))
+    return mps
+
+
+def get_bit_strings(gammas, betas, nreps=10000, problem=grid_problem):
     """Measures the QAOA circuit in the computational basis to get bitstrings."""
-    circ = qaoa(gammas, betas)
-    circ.append(
-        cirq.measure(*[qubit for row in qreg for qubit in row], key='m'))
+    circ = qaoa(gammas, betas, problem)
+    circ.append(cirq.measure(*problem.qubits, key='m'))
 
     # Simulate the circuit
     sim = cirq.Simulator()
@@ -154,17 +981,135 @@ def get_bit_strings(gammas, betas, nreps=10000):
 
     return res
 
-# Sample to get bits and convert to a histogram
-bits = get_bit_strings([gamma_opt], [beta_opt])
-hist = bits.histogram(key="m")
 
-# Get the most common bits
-top = hist.most_common(2)
+def sample_bit_strings(gammas, betas, nreps=10000, problem=grid_problem,
+                       seed=None):
+    """Samples bitstrings from the QAOA wavefunction without a simulator run
+    per shot.
+
+    The wavefunction is simulated once and all nreps outcomes are drawn at
+    once from |psi|^2 with a multinomial, so the cost does not depend on the
+    depth of the circuit and barely on nreps.
+
+    Returns:
+        A collections.Counter from each measured bitstring, packed into an
+        integer as in cirq histograms, to its number of occurrences.
+    """
+    probs = np.abs(qaoa_state(gammas, betas, problem)) ** 2
+    counts = np.random.default_rng(seed).multinomial(nreps, probs / probs.sum())
+    outcomes = np.flatnonzero(counts)
+    return collections.Counter(dict(zip(outcomes.tolist(),
+                                        counts[outcomes].tolist())))
+
+
+if __name__ == "__main__":
+    # 26.s.one
+    # Make sure the circuit gives the correct matrix
+    qreg2 = cirq.LineQubit.range(2)
+    zzcirc = ZZ(qreg2[0], qreg2[1], 0.5)
+    print("Circuit for ZZ gate:", zzcirc, sep="\n")
+    print("\nUnitary of circuit:", zzcirc.unitary().round(2), sep="\n")
+
+    # Check the single ZZPowGate against the construction from CZ gates
+    for gamma in np.linspace(-1, 1, 9):
+        assert np.allclose(ZZ(*qreg2, gamma).unitary(),
+                           ZZ_cz(*qreg2, gamma).unitary())
+
+    # Get a range of parameters
+    gammavals = np.linspace(0, 1.0, 50)
+    betavals = np.linspace(0, np.pi, 75)
+
+    # Compute the cost at all parameter values using a grid search
+    costmat = grid_search(gammavals, betavals)
+
+    # Plot the cost landscape
+    plt.imshow(costmat, extent=(0, 1, 0, np.pi), origin="lower", aspect="auto")
+    plt.colorbar()
+    plt.show()
+
+    # Coordinates from the grid of cost values
+    gamma_coord, beta_coord = np.where(costmat == np.min(costmat))
+
+    # Values from the coordinates
+    gamma_opt = gammavals[gamma_coord[0]]
+    beta_opt = betavals[beta_coord[0]]
+
+    # Sample to get a histogram of bits
+    hist = sample_bit_strings([gamma_opt], [beta_opt])
+
+    # Get the most common bits
+    top = hist.most_common(2)
+
+    # Print out the two most common bitstrings measured
+    print("\nMost common bitstring:")
+    print(format(top[0][0], "#010b"))
+
+    print("\nSecond most common bitstring:")
+    print(bin(top[1][0]))
+
+
+    # Optimize deeper circuits with exact gradients
+    print("\nOptimized energy per site with gradients:")
+    for p in range(1, 5):
+        result = optimize_qaoa(p)
+        print("p = {}: {:.6f} ({} evaluations)".format(p, result.fun,
+                                                     result.nfev))
+
+    # Light cones give the energy of grids far too large to simulate
+    print("\nEnergy per site on a 20 x 20 grid at the best grid point:",
+          light_cone_energy([gamma_opt], [beta_opt],
+                            IsingProblem.grid(20, 20)))
+
+    # The same functions work for MaxCut on an arbitrary weighted graph
+    graph = IsingProblem.maxcut(
+        6, [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5), (5, 0), (0, 3, 0.5)])
+    costmat = grid_search(gammavals, betavals, graph)
+    gamma_coord, beta_coord = np.where(costmat == np.min(costmat))
+    print("\nMaxCut energy per site at the best grid point:", np.min(costmat))
+    hist = sample_bit_strings([gammavals[gamma_coord[0]]],
+                              [betavals[beta_coord[0]]], problem=graph)
+    print("Most common cut:", format(hist.most_common(1)[0][0], "06b"))
+
+    # The fingerprint does not depend on the labels of the sites, nor on the
+    # types of the weights and fields
+    relabeled = IsingProblem(
+        6, [(1, 2, -1), (2, 3, -1.0), (3, 4, np.float64(-1)), (4, 5, -1),
+            (5, 0, -1), (0, 1, -1), (1, 4, -0.5)],
+        fields=[0, 0.0, np.float64(0), 0, 0, -0.0])
+    assert relabeled.fingerprint() == graph.fingerprint()
+    assert (IsingProblem.grid(2, 2, h=np.zeros((2, 2), dtype=int))
+            .fingerprint() == IsingProblem.grid(2, 2).fingerprint())
 
-# Print out the two most common bitstrings measured
-print("\nMost common bitstring:")
-print(format(top[0][0], "#010b"))
+    # but problems which are not isomorphic can share it, such as K3,3 and
+    # the triangular prism, so stored parameters are keyed by the digest,
+    # which only equal problems share
+    k33 = IsingProblem.maxcut(6, [(i, j) for i in range(3)
+                                  for j in range(3, 6)])
+    prism = IsingProblem.maxcut(6, [(0, 1), (1, 2), (2, 0), (3, 4), (4, 5),
+                                    (5, 3), (0, 3), (1, 4), (2, 5)])
+    assert k33.fingerprint() == prism.fingerprint()
+    assert k33.digest() != prism.digest()
+    assert relabeled.digest() != graph.digest()
+    assert IsingProblem(
+        6, [(1, 0, -1), (1, 2, -1.0), (2, 3, np.float64(-1)), (3, 4, -1),
+            (4, 5, -1), (5, 0, -1), (3, 0, -0.5)],
+        fields=[0, 0.0, np.float64(0), 0, 0, -0.0]).digest() == graph.digest()
 
-print("\nSecond most common bitstring:")
-print(bin(top[1][0]))
+    # Optimized parameters are kept on disk, so running this again starts
+    # every depth from the stored optimum
+    store = ParameterStore(os.path.join(tempfile.gettempdir(),
+                                        "qaoa-parameters.json"))
+    print("\nMaxCut energy per site with stored warm starts:")
+    for p in range(1, 5):
+        result = optimize_qaoa_stored(p, graph, store)
+        print("p = {}: {:.6f} ({} evaluations)".format(p, result.fun,
+                                                     result.nfev))
 
+    # Matrix product states reach grids too large for a wavefunction
+    big_grid = IsingProblem.grid(6, 6)
+    mps = simulate_mps(qaoa([gamma_opt], [beta_opt], big_grid), big_grid)
+    print("\nEnergy per site on a 6 x 6 grid from an MPS:",
+          mps.energy(big_grid), "(truncation error {:.1e})".format(
+              mps.truncation_error))
+    print("Most common bitstring:",
+          format(mps.sample(1000).most_common(1)[0][0], "036b"))
@@ -1,6 +1,10 @@
 """Quantum neural network in Cirq."""
 
 # Imports
+import concurrent.futures
+import os
+import time
+
 import cirq
 import matplotlib.pyplot as plt
 import numpy as np
@@ -48,9 +52,6 @@ INPUT_SIZE = 9
 data_qubits = cirq.LineQubit.range(INPUT_SIZE)
 readout = cirq.NamedQubit('r')
 
-# Initialize parameters of the circuit
-params = {'w': 0}
-
 def ZX_layer():
   """Adds a ZX gate between each data qubit and the readout.
   All gates are given the same sympy.Symbol for a weight."""
@@ -62,9 +63,10 @@ qnn = cirq.Circuit()
 qnn.append(ZX_layer())
 qnn.append([cirq.S(readout)**-1, cirq.H(readout)]) # Basis transformation
 
-def readout_expectation(state):
-  """Takes in a specification of a state as an array of 0s and 1s
-  and returns the expectation value of Z on the readout qubit.
+def readout_expectation(state, params):
+  """Takes in a specification of a state as an array of 0s and 1s and the
+  parameters of the circuit, such as {'w': 0.5}, and returns the
+  expectation value of Z on the readout qubit.
   Uses the Simulator to calculate the wavefunction exactly."""
 
   # A convenient representation of the state as an integer
@@ -85,41 +87,379 @@ def readout_expectation(state):
   # Use np.real to eliminate +0j term
   return np.real(np.sum(wf*wf.conjugate()*Z_readout))
 
-def loss(states, labels):
-  loss=0
-  for state, label in zip(states,labels):
-    loss += 1 - label*readout_expectation(state)
-  return loss/(2*len(states))
+# Z on the readout, which is the most significant qubit in the order used
+# below, is +1 on the first half of the wavefunction and -1 on the second
+Z_readout = np.append(np.ones(2**INPUT_SIZE), -np.ones(2**INPUT_SIZE))
+
+def commuting_structure(circuit, symbols):
+  """Checks whether a circuit is made of ZX gates from data qubits to the
+  readout followed by the basis transformation, and if so returns how the
+  weights add up on each data qubit.
+
+  All such ZX gates commute, and on a computational basis input with spins
+  z_i = +1 or -1 they act together as exp(i pi theta X) on the readout, with
+  theta = sum_i z_i W_i, where W_i is the total weight on data qubit i.
+
+  Returns:
+      A matrix A and a vector b with W = A @ weights + b for the weights of
+      the symbols, or None if the circuit does not have this structure.
+  """
+  ops = list(circuit.all_operations())
+  if ops[-2:] != [cirq.S(readout)**-1, cirq.H(readout)]:
+    return None
+  index = {symbol: k for k, symbol in enumerate(symbols)}
+  A = np.zeros((INPUT_SIZE, len(symbols)))
+  b = np.zeros(INPUT_SIZE)
+  for op in ops[:-2]:
+    if (not isinstance(op.gate, ZXGate) or op.qubits[1] != readout or
+        op.qubits[0] not in data_qubits):
+      return None
+    i = data_qubits.index(op.qubits[0])
+    if op.gate.weight in index:
+      A[i, index[op.gate.weight]] += 1
+    elif isinstance(op.gate.weight, (int, float)):
+      b[i] += op.gate.weight
+    else:
+      return None
+  return A, b
+
+def analytic_expectations(structure, weights, states):
+  """Returns the readout expectations of a batch of states for a circuit
+  with a commuting structure, and their gradients with respect to the
+  weights, in O(n) operations per state.
+
+  The readout goes from 0 to cos(pi theta)|0> + i sin(pi theta)|1>, and the
+  basis transformation turns Z into Y, so the expectation is
+  sin(2 pi theta).
+  """
+  A, b = structure
+  # Data qubit i holds bit INPUT_SIZE - 1 - i of the state number
+  spins = 1 - 2*np.asarray(states)[:, ::-1]
+  theta = spins @ (A @ np.asarray(weights, dtype=float) + b)
+  expectations = np.sin(2*np.pi*theta)
+  gradients = (2*np.pi*np.cos(2*np.pi*theta))[:, None]*(spins @ A)
+  return expectations, gradients
+
+def readout_expectations(states, params, circuit=qnn, analytic=True):
+  """Takes in a batch of states, as an array of 0s and 1s with one state per
+  row, and the parameters of the circuit, and returns the expectation value
+  of Z on the readout for each.
+
+  For the commuting ZX layer the expectations are computed analytically,
+  unless analytic is False. Otherwise the unitary of the circuit is
+  computed once, and since the readout starts in 0, the final wavefunction
+  for each input is the column of the unitary indexed by the input state.
+  """
+  symbols = [sympy.Symbol(str(name)) for name in params]
+  structure = commuting_structure(circuit, symbols) if analytic else None
+  if structure is not None:
+    return analytic_expectations(structure, list(params.values()), states)[0]
+
+  state_nums = np.asarray(states) @ 2**np.arange(INPUT_SIZE)
+
+  resolved = cirq.resolve_parameters(circuit, cirq.ParamResolver(params))
+  unitary = resolved.unitary(qubit_order=[readout]+data_qubits)
+
+  return Z_readout @ np.abs(unitary[:, state_nums])**2
+
+def loss_and_error(states, labels, params, **kwargs):
+  """Returns the loss and the classification error of the batch, from a
+  single evaluation of the readout expectations. The keyword arguments are
+  passed on to readout_expectations."""
+  expectations = readout_expectations(states, params, **kwargs)
+  loss = np.sum(1 - labels*expectations)/(2*len(states))
+  error = np.sum(1 - labels*np.sign(expectations))/(2*len(states))
+  return loss, error
+
+def loss(states, labels, params):
+  return loss_and_error(states, labels, params)[0]
+
+def classification_error(states, labels, params):
+  return loss_and_error(states, labels, params)[1]
+
+def _sweep_chunk(states, labels, weights, kwargs):
+  """Returns the loss and error at each weight of the shared-weight QNN."""
+  results = [loss_and_error(states, labels, {'w': w}, **kwargs)
+             for w in weights]
+  return np.array(results).reshape(-1, 2).T
+
+def sweep_weights(states, labels, weights, max_workers=None,
+                  shard_data=False, **kwargs):
+  """Computes the loss and error curves of the shared-weight QNN over a
+  range of weights with a pool of processes.
+
+  Each worker evaluates a contiguous chunk of the weights on all the data,
+  or, with shard_data, all the weights on a shard of the data, in which
+  case the curves of the shards are averaged with the shard sizes as
+  weights. Sharding the data is better when there are more states than
+  weights. The keyword arguments are passed on to readout_expectations.
+
+  Returns:
+      Arrays of the loss and of the classification error at each weight.
+  """
+  states = np.asarray(states)
+  labels = np.asarray(labels)
+  weights = np.asarray(weights)
+  nchunks = max_workers or os.cpu_count()
+  with concurrent.futures.ProcessPoolExecutor(nchunks) as executor:
+    if shard_data:
+      shards = np.array_split(np.arange(len(states)), nchunks)
+      futures = [executor.submit(_sweep_chunk, states[shard], labels[shard],
+                                 weights, kwargs)
+                 for shard in shards if len(shard)]
+      sizes = [len(shard) for shard in shards if len(shard)]
+      curves = sum(size*future.result()
+                   for size, future in zip(sizes, futures))/len(states)
+    else:
+      chunks = np.array_split(weights, nchunks)
+      futures = [executor.submit(_sweep_chunk, states, labels, chunk, kwargs)
+                 for chunk in chunks]
+      curves = np.concatenate([future.result() for future in futures],
+                              axis=1)
+  return curves[0], curves[1]
+
+def multi_weight_qnn(n_layers=1):
+  """Returns a QNN with n_layers ZX layers in which every gate has its own
+  weight, together with the list of weight symbols. The weight of the gate
+  between data qubit i and the readout in layer l is the sympy.Symbol
+  'w_l_i'."""
+  symbols = []
+  circuit = cirq.Circuit()
+  for layer in range(n_layers):
+    for i, qubit in enumerate(data_qubits):
+      symbol = sympy.Symbol('w_{}_{}'.format(layer, i))
+      symbols.append(symbol)
+      circuit.append(ZXGate(symbol).on(qubit, readout))
+  circuit.append([cirq.S(readout)**-1, cirq.H(readout)])
+  return circuit, symbols
+
+def batch_expectations(circuit, symbols, weights, states):
+  """Returns the expectation value of Z on the readout for every state in a
+  batch, with the given values of the weight symbols.
+
+  Circuits with a commuting structure are evaluated analytically, others
+  with simulate_expectations.
+  """
+  structure = commuting_structure(circuit, symbols)
+  if structure is not None:
+    return analytic_expectations(structure, weights, states)[0]
+  return simulate_expectations(circuit, symbols, weights, states)
+
+def simulate_expectations(circuit, symbols, weights, states):
+  """Returns the same as batch_expectations by simulation.
+
+  Only the columns of the unitary for the input states are computed, by
+  applying the gates to all of them at once.
+  """
+  state_nums = np.asarray(states) @ 2**np.arange(INPUT_SIZE)
+  n = INPUT_SIZE + 1
+  target = np.zeros((2**n, len(state_nums)), dtype=complex)
+  target[state_nums, np.arange(len(state_nums))] = 1
+  target = target.reshape((2,)*n + (len(state_nums),))
+
+  resolved = cirq.resolve_parameters(
+      circuit, cirq.ParamResolver(dict(zip(symbols, weights))))
+  args = cirq.ApplyUnitaryArgs(target, np.empty_like(target), range(n))
+  final = cirq.apply_unitaries(resolved.all_operations(),
+                               [readout]+data_qubits, args)
+  return Z_readout @ np.abs(final.reshape(2**n, -1))**2
 
-def classification_error(states, labels):
-  error=0
-  for state,label in zip(states,labels):
-    error += 1 - label*np.sign(readout_expectation(state))
-  return error/(2*len(states))
+def loss_gradient(circuit, symbols, weights, states, labels):
+  """Returns the loss of the batch and its gradient with respect to the
+  weights.
+
+  A ZXGate with weight w is exp(i pi w ZX), so each expectation is a
+  sinusoid in w with frequency 2 pi, and the parameter shift rule
+
+    dE/dw = pi (E(w + 1/4) - E(w - 1/4))
+
+  is exact. Both shifts of each weight are evaluated for the whole batch at
+  once. Circuits with a commuting structure use the analytic gradient
+  instead.
+  """
+  weights = np.asarray(weights, dtype=float)
+  labels = np.asarray(labels)
+  # The loss depends on each expectation E with coefficient -label/(2 N)
+  scale = -labels/(2*len(states))
+
+  structure = commuting_structure(circuit, symbols)
+  if structure is not None:
+    expectations, gradients = analytic_expectations(structure, weights,
+                                                    states)
+    return np.sum(1 - labels*expectations)/(2*len(states)), scale @ gradients
+
+  loss = np.sum(1 - labels*simulate_expectations(
+      circuit, symbols, weights, states))/(2*len(states))
+  gradient = np.zeros(len(weights))
+  for k in range(len(weights)):
+    shift = np.zeros(len(weights))
+    shift[k] = 0.25
+    derivative = np.pi*(
+        simulate_expectations(circuit, symbols, weights + shift, states) -
+        simulate_expectations(circuit, symbols, weights - shift, states))
+    gradient[k] = scale @ derivative
+  return loss, gradient
+
+def train_qnn(states, labels, n_layers=1, epochs=20, batch_size=20,
+              learning_rate=0.05, method='adam', seed=0):
+  """Trains a multi-weight QNN by minibatch gradient descent.
+
+  Args:
+      states, labels: Training data, as returned by make_batch.
+      n_layers: Number of ZX layers of the QNN.
+      epochs: Number of passes through the data.
+      batch_size: Number of states per gradient step.
+      learning_rate: Step size.
+      method: 'sgd' for plain gradient steps or 'adam' for Adam.
+      seed: Seed for the initial weights and the order of the minibatches.
+
+  Returns:
+      The circuit, its weight symbols, the trained weights and the loss of
+      every minibatch.
+  """
+  states = np.asarray(states)
+  labels = np.asarray(labels)
+  rng = np.random.default_rng(seed)
+
+  def batches():
+    for _ in range(epochs):
+      order = rng.permutation(len(states))
+      for start in range(0, len(states), batch_size):
+        batch = order[start:start + batch_size]
+        yield states[batch], labels[batch]
+
+  return train_on_batches(batches(), n_layers, learning_rate, method, rng)
+
+def train_on_batches(batches, n_layers=1, learning_rate=0.05, method='adam',
+                     seed=0):
+  """Trains a multi-weight QNN with one gradient step per minibatch.
+
+  Args:
+      batches: Iterable of (states, labels) minibatches, such as
+          minibatches(stream_data(...)).
+      n_layers, learning_rate, method: As for train_qnn.
+      seed: Seed or numpy Generator for the initial weights.
+
+  Returns:
+      The same as train_qnn.
+  """
+  circuit, symbols = multi_weight_qnn(n_layers)
+  rng = np.random.default_rng(seed)
+  weights = rng.normal(scale=0.1, size=len(symbols))
+
+  # Moment estimates for Adam
+  beta1, beta2, eps = 0.9, 0.999, 1e-8
+  m = np.zeros(len(weights))
+  v = np.zeros(len(weights))
+  step = 0
+
+  losses = []
+  for batch_states, batch_labels in batches:
+    batch_loss, gradient = loss_gradient(circuit, symbols, weights,
+                                         batch_states, batch_labels)
+    losses.append(batch_loss)
+    if method == 'sgd':
+      weights -= learning_rate*gradient
+    elif method == 'adam':
+      step += 1
+      m = beta1*m + (1 - beta1)*gradient
+      v = beta2*v + (1 - beta2)*gradient**2
+      m_hat = m/(1 - beta1**step)
+      v_hat = v/(1 - beta2**step)
+      weights -= learning_rate*m_hat/(np.sqrt(v_hat) + eps)
+    else:
+      raise ValueError("method must be 'sgd' or 'adam', not {!r}".format(
+          method))
+  return circuit, symbols, weights, losses
 
 def make_batch():
   """Generates a set of labels, then uses those labels to generate inputs.
   label = -1 corresponds to majority 0 in the sate, label = +1 corresponds to
   majority 1.
   """
-  np.random.seed(0) # For consistency in demo
-  labels = (-1)**np.random.choice(2, size=100) # Smaller batch sizes will speed up computation
+  rng = np.random.RandomState(0) # For consistency in demo
+  labels = (-1)**rng.choice(2, size=100) # Smaller batch sizes will speed up computation
   states = []
   for label in labels:
-    states.append(np.random.choice(2, size=INPUT_SIZE, p=[0.5-label*0.2,0.5+label*0.2]))
+    states.append(rng.choice(2, size=INPUT_SIZE, p=[0.5-label*0.2,0.5+label*0.2]))
   return states, labels
 
-states, labels = make_batch()
-
-linspace = np.linspace(start=-1, stop=1, num=80)
-train_losses = []
-error_rates = []
-for p in linspace:
-  params = {'w': p}
-  train_losses.append(loss(states, labels))
-  error_rates.append(classification_error(states, labels))
-plt.plot(linspace, train_losses)
-plt.xlabel('Weight')
-plt.ylabel('Loss')
-plt.title('Loss as a Function of Weight')
-plt.show()
+def stream_data(n_samples, chunk_size=2**16, seed=0):
+  """Generates labelled inputs as make_batch does, in chunks of at most
+  chunk_size samples, so that any number of samples fits in memory.
+
+  Yields:
+      Pairs of arrays (state_nums, labels). Each input is packed into an
+      integer whose bit k is entry k of the state.
+  """
+  rng = np.random.default_rng(seed)
+  for start in range(0, n_samples, chunk_size):
+    size = min(chunk_size, n_samples - start)
+    labels = (-1)**rng.integers(2, size=size)
+    bits = rng.random((size, INPUT_SIZE)) < (0.5 + 0.2*labels)[:, None]
+    yield bits @ 2**np.arange(INPUT_SIZE), labels
+
+def unpack_states(state_nums):
+  """Returns the states packed into integers by stream_data as an array of
+  0s and 1s with one state per row."""
+  return (np.asarray(state_nums)[:, None] >> np.arange(INPUT_SIZE)) & 1
+
+def minibatches(chunks, batch_size=20):
+  """Splits the chunks of stream_data into minibatches for
+  train_on_batches."""
+  for state_nums, labels in chunks:
+    for start in range(0, len(labels), batch_size):
+      yield (unpack_states(state_nums[start:start + batch_size]),
+             labels[start:start + batch_size])
+
+def evaluate_stream(chunks, params, **kwargs):
+  """Computes the loss and the classification error over the chunks of
+  stream_data, one chunk at a time. The keyword arguments are passed on to
+  readout_expectations.
+
+  Returns:
+      The loss, the error and a dict with the number of samples, the time
+      taken in seconds and the samples per second.
+  """
+  start = time.perf_counter()
+  total_loss = total_error = 0.0
+  n_samples = 0
+  for state_nums, labels in chunks:
+    loss, error = loss_and_error(unpack_states(state_nums), labels, params,
+                                 **kwargs)
+    total_loss += loss*len(labels)
+    total_error += error*len(labels)
+    n_samples += len(labels)
+  seconds = time.perf_counter() - start
+  stats = {'samples': n_samples, 'seconds': seconds,
+           'samples_per_second': n_samples/seconds}
+  return total_loss/n_samples, total_error/n_samples, stats
+
+if __name__ == "__main__":
+  states, labels = make_batch()
+
+  # Sweep the shared weight, spread over all cores
+  linspace = np.linspace(start=-1, stop=1, num=80)
+  train_losses, error_rates = sweep_weights(states, labels, linspace)
+  plt.plot(linspace, train_losses)
+  plt.xlabel('Weight')
+  plt.ylabel('Loss')
+  plt.title('Loss as a Function of Weight')
+  plt.show()
+
+  # Train a QNN with a separate weight on every gate by gradient descent
+  circuit, symbols, weights, batch_losses = train_qnn(states, labels)
+
+  # Check the analytic expectations against the simulation
+  assert np.allclose(batch_expectations(circuit, symbols, weights, states),
+                     simulate_expectations(circuit, symbols, weights, states))
+  print('Loss after training:', batch_losses[-1])
+  print('Trained weights:', np.round(weights, 3))
+
+  # Evaluate the trained QNN on a million fresh samples, streamed in chunks
+  trained = {str(symbol): w for symbol, w in zip(symbols, weights)}
+  test_loss, test_error, stats = evaluate_stream(stream_data(10**6, seed=1),
+                                                 trained, circuit=circuit)
+  print('Test loss: {:.4f}, test error: {:.4f}'.format(test_loss, test_error))
+  print('{} samples in {:.2f} s ({:.0f} samples per second)'.format(
+      stats['samples'], stats['seconds'], stats['samples_per_second']))
@@ -2,6 +2,7 @@
 
 # Imports
 import numpy as np
+from scipy.linalg import schur
 from scipy.stats import unitary_group
 
 import cirq
@@ -23,6 +24,87 @@ def binary_decimal(string):
             val += 2**(-1 -ind)
     return val
 
+def decode_phases(outcomes, n, msb_first=True):
+    """Returns the phases 0.abc... for an array of integer outcomes of an
+    n-bit readout register, all at once.
+
+    Args:
+        outcomes: Integer outcomes, of any shape.
+        n: Number of readout qubits.
+        msb_first: Whether the first readout qubit, which is the most
+            significant bit of the outcome, holds the first bit a of the
+            phase. If False the bits are read in the reverse order.
+    """
+    outcomes = np.asarray(outcomes, dtype=np.int64)
+    if not msb_first:
+        bits = (outcomes[..., None] >> np.arange(n)) & 1
+        outcomes = bits @ (2**np.arange(n - 1, -1, -1))
+    return outcomes / 2**n
+
+def _fejer_kernel(delta, N):
+    """Returns |sin(pi N delta) / (N sin(pi delta))|^2, which is 1 where
+    delta is an integer."""
+    numer = np.sin(np.pi * N * delta)
+    denom = N * np.sin(np.pi * delta)
+    exact = np.isclose(denom, 0)
+    return np.where(exact, 1.0, numer / np.where(exact, 1.0, denom))**2
+
+def qpe_distribution(unitary, state, n):
+    """Returns the exact outcome distribution of ideal QPE with n readout
+    qubits, computed from the eigendecomposition of the unitary.
+
+    If the state has weight w_j on the eigenvector with eigenvalue
+    exp(2 pi i phi_j), the outcome y has probability
+
+        P(y) = sum_j w_j |sin(pi N d_j) / (N sin(pi d_j))|^2,
+
+    where N = 2^n and d_j = phi_j - y / N.
+
+    Returns:
+        The probabilities of the outcomes 0, ..., N - 1, with the most
+        significant bit of the outcome on the first readout qubit, and the
+        arrays of phases phi_j and weights w_j.
+    """
+    # The Schur form of a unitary is diagonal, and unlike np.linalg.eig
+    # its eigenvectors are orthonormal even for repeated eigenvalues.
+    diag, vecs = schur(unitary, output="complex")
+    phases = np.mod(np.angle(np.diag(diag)) / (2 * np.pi), 1)
+    weights = np.abs(vecs.conj().T @ state)**2
+
+    N = 2**n
+    kernel = _fejer_kernel(phases[:, None] - np.arange(N) / N, N)
+    return weights @ kernel, phases, weights
+
+def qpe_estimates(unitary, state, n, tolerance=0, min_weight=1e-9):
+    """Returns the n-bit QPE estimate of each eigenvalue which the state
+    overlaps, with a confidence for each.
+
+    The confidence is the probability that QPE started in the eigenvector
+    gives an outcome within tolerance of the estimate, counted cyclically.
+    For tolerance 0 it is at least 4 / pi^2. Repeated eigenvalues are
+    reported once, with the total weight of their eigenspace.
+
+    Returns:
+        Arrays of the estimated eigenvalues, the weights of the state on
+        their eigenvectors and the confidences.
+    """
+    _, phases, weights = qpe_distribution(unitary, state, n)
+    _, first, index = np.unique(np.round(phases, 9) % 1, return_index=True,
+                                return_inverse=True)
+    phases = phases[first]
+    weights = np.bincount(index.ravel(), weights)
+    keep = weights > min_weight
+    phases, weights = phases[keep], weights[keep]
+
+    N = 2**n
+    best = np.round(phases * N).astype(np.int64) % N
+    offsets = np.arange(-min(tolerance, N // 2),
+                        min(tolerance, (N - 1) // 2) + 1)
+    delta = phases[:, None] - (best[:, None] + offsets) / N
+    confidence = np.sum(_fejer_kernel(delta, N), axis=1)
+    estimates = np.exp(2j * np.pi * decode_phases(best, n))
+    return estimates, weights, confidence
+
 # =============================================================================
 # Input to QPE
 # =============================================================================
@@ -121,10 +203,26 @@ hist = res.histogram(key="z")
 
 top = hist.most_common(2)
 
-estimated = [np.exp(2j * np.pi * binary_decimal(bin(x[0]))) for x in top]
+outcomes = np.array([x[0] for x in top])
+estimated = np.exp(2j * np.pi * decode_phases(outcomes, n))
 
 print("\nEigenvalues from QPE:")
 print(sorted(estimated, key=lambda x: abs(x)**2))
 
 print("\nActual eigenvalues:")
 print(sorted(evals, key=lambda x: abs(x)**2))
+
+# =============================================================================
+# Exact QPE without sampling
+# =============================================================================
+
+# The eigenstate register starts in |0...0>
+state = np.zeros(dim)
+state[0] = 1
+
+estimates, weights, confidence = qpe_estimates(unitary, state, n)
+
+print("\nEigenvalues from the exact QPE distribution:")
+for estimate, weight, conf in zip(estimates, weights, confidence):
+    print("{:.6f} (weight {:.3f}, confidence {:.3f})".format(
+        estimate, weight, conf))
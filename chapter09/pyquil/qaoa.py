@@ -23,9 +23,14 @@ implementation of QAOA, refer to the grove example and docs:
 http://grove-docs.readthedocs.io/en/latest/qaoa.html
 """
 
+import os
+import sys
+
+import numpy as np
+
 from pyquil import get_qc
 from pyquil.quil import Program
-from pyquil.gates import H
+from pyquil.gates import H, MEASURE
 from pyquil.paulis import sI, sX, sZ, exponentiate_commuting_pauli_sum
 
 # Create a 4-node array graph: 0-1-2-3.
@@ -58,11 +63,60 @@ def qaoa_ansatz(gammas, betas):
                     for g, b in zip(gammas, betas)])
 
 
+def parametric_qaoa_program(p, trials):
+    """
+    Function that returns a QAOA program of order P whose angles are read from the classical
+    memory regions gamma and beta, each of size P. The program is compiled once, and each
+    evaluation only writes new angles into memory instead of building and compiling a new program.
+    :param int p: Order of the QAOA program.
+    :param int trials: Number of times the program is run per evaluation.
+    :return: The QAOA program, including measurements of all qubits into ro.
+    :rtype: Program.
+    """
+    program = Program()
+    gammas = program.declare("gamma", "REAL", p)
+    betas = program.declare("beta", "REAL", p)
+    ro = program.declare("ro", "BIT", len(nodes))
+    program += init_state_prog + qaoa_ansatz(list(gammas), list(betas))
+    program += [MEASURE(i, ro[i]) for i in nodes]
+    program.wrap_in_numshots_loop(trials)
+    return program
+
+
+def expected_cut(qc, executable, gammas, betas):
+    """
+    Function that runs a compiled parametric QAOA program at the given angles and returns the
+    average number of edges of the graph cut by the measured bitstrings.
+    :param QuantumComputer qc: The quantum computer which compiled the executable.
+    :param executable: The compiled output of parametric_qaoa_program.
+    :param list(float) gammas: Angles for the cost Hamiltonian.
+    :param list(float) betas: Angles for the driver Hamiltonian.
+    :return: The average cut size.
+    :rtype: float.
+    """
+    bitstrings = qc.run(executable, memory_map={"gamma": list(gammas), "beta": list(betas)})
+    return np.mean(sum(bitstrings[:, i] != bitstrings[:, j] for i, j in graph))
+
+
 # Create a program, the state initialization plus a QAOA ansatz program, for P = 2.
 program = init_state_prog + qaoa_ansatz([0., 0.5], [0.75, 1.])
 
-# Initialize the QVM and run the program.
+# Initialize the QVM and run the program. With LOCAL_QVM=1 set in the environment the program
+# is simulated in this process instead of on a QVM server.
+if os.environ.get("LOCAL_QVM"):
+    # The local QVM is shared with the pyQuil examples of Chapter 6.
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 "..", "..", "chapter06", "forest"))
+    import local_qvm
+    get_qc = local_qvm.get_qc
 qc = get_qc('9q-generic-qvm')
 
 results = qc.run_and_measure(program, trials=2)
 
+# Compile a parametric program for P = 1 once and scan the angles by writing them into memory.
+executable = qc.compile(parametric_qaoa_program(1, trials=1000))
+angles = np.linspace(0, np.pi, 8)
+cuts = [[expected_cut(qc, executable, [g], [b]) for b in angles] for g in angles]
+best = np.unravel_index(np.argmax(cuts), (len(angles), len(angles)))
+print("Best average cut {:.3f} at gamma = {:.3f}, beta = {:.3f}".format(
+    np.max(cuts), angles[best[0]], angles[best[1]]))